@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the JSON-RPC response encoding per response size
+
+Compares the previous encoding (tool result pretty-printed with the standard
+library, then escaped again inside the response) with the compact codec
+encoding, for every JSON library that is installed. Decode is the client side
+cost of reading the response line back.
+
+Usage: python bench_json_codec.py [--repeat N] | tee bench_output.txt
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server.mcp_server import JsonCodec  # noqa: E402
+
+SIZES = [("1KB", 1024), ("64KB", 64 * 1024), ("1MB", 1024 * 1024), ("16MB", 16 * 1024 * 1024)]
+
+
+def make_result(size):
+    """A fetch_merge_request_diff style result with about size bytes of diff text"""
+    rng = random.Random(size)
+    files = []
+    total = 0
+    while total < size:
+        lines = ["@@ -%d,7 +%d,9 @@ def handler(request):" % (total, total)]
+        for _ in range(rng.randint(5, 60)):
+            lines.append(rng.choice("+- ") + "    value = compute(\"%s\", %d)\t# é" % ("x" * rng.randint(0, 40), total))
+        diff = "\n".join(lines) + "\n"
+        files.append({"file": "src/pkg/module_%d.py" % len(files), "diff": diff})
+        total += len(diff)
+    return files
+
+
+def envelope(text):
+    return {"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}]}}
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement; the best one is reported")
+    args = parser.parse_args()
+
+    codecs = []
+    for name in ("json", "orjson", "msgspec"):
+        codec = JsonCodec(name)
+        if codec.name == name:
+            codecs.append(codec)
+    print("codecs: " + ", ".join(c.name for c in codecs))
+    print("%-6s %-16s %12s %12s %12s" % ("size", "encoding", "encode ms", "decode ms", "bytes"))
+
+    for label, size in SIZES:
+        result = make_result(size)
+        repeat = args.repeat if size < 8 * 1024 * 1024 else max(1, args.repeat // 2)
+
+        def legacy_encode():
+            return (json.dumps(envelope(json.dumps(result, indent=2))) + "\n").encode("utf-8")
+
+        line = legacy_encode()
+        rows = [("indent=2 stdlib", best_of(repeat, legacy_encode),
+                 best_of(repeat, lambda: json.loads(line)), len(line))]
+        for codec in codecs:
+            def encode(codec=codec):
+                return codec.encode(envelope(codec.encode(result).decode("utf-8"))) + b"\n"
+
+            line = encode()
+            rows.append(("compact " + codec.name, best_of(repeat, encode),
+                         best_of(repeat, lambda codec=codec, line=line: codec.decode(line)), len(line)))
+        for name, encode_time, decode_time, length in rows:
+            print("%-6s %-16s %12.3f %12.3f %12d" % (label, name, encode_time * 1000, decode_time * 1000, length))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,102 +1,2044 @@
 #!/usr/bin/env python3
 import sys
+import base64
+import codecs
+import functools
+import hashlib
+import hmac
 import json
-import requests
 import os
+import re
+import threading
+import time
 import urllib.parse
+import uuid
+import bisect
+import itertools
+import multiprocessing
+import operator
+import socket
+import socketserver
+import subprocess
+from array import array
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 
 GITLAB_URL = os.environ.get("GITLAB_URL", "https://gitlab.example.com")
 GITLAB_TOKEN = os.environ.get("GITLAB_TOKEN")
 GITLAB_PROJECT_PATH = os.environ.get("GITLAB_PROJECT_PATH", "your-group/your-project")
+# Maximum number of tool calls that run at the same time
+MCP_MAX_WORKERS = int(os.environ.get("MCP_MAX_WORKERS", "8"))
+# Maximum number of inline comments posted at the same time by the batch tool
+GITLAB_COMMENT_CONCURRENCY = int(os.environ.get("GITLAB_COMMENT_CONCURRENCY", "4"))
+# Maximum number of merge requests fetched at the same time by the multi-MR diff tool
+GITLAB_FETCH_CONCURRENCY = int(os.environ.get("GITLAB_FETCH_CONCURRENCY", "4"))
+# Number of per-host connection pools kept by the shared GitLab session
+GITLAB_POOL_CONNECTIONS = int(os.environ.get("GITLAB_POOL_CONNECTIONS", "4"))
+# Maximum number of open connections to a single host; defaults to one per worker
+GITLAB_POOL_MAXSIZE = int(os.environ.get("GITLAB_POOL_MAXSIZE", str(MCP_MAX_WORKERS)))
+# Limits of the in-process merge request changes cache
+MR_CACHE_MAX_ENTRIES = int(os.environ.get("MR_CACHE_MAX_ENTRIES", "32"))
+MR_CACHE_MAX_BYTES = int(os.environ.get("MR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MR_CACHE_TTL = float(os.environ.get("MR_CACHE_TTL", "900"))
+# Seconds a cached merge request is served without checking GitLab for a new push
+MR_CACHE_HEAD_TTL = float(os.environ.get("MR_CACHE_HEAD_TTL", "10"))
+# Limits of the store of ETag/Last-Modified validated GitLab responses
+GITLAB_REVALIDATE_MAX_ENTRIES = int(os.environ.get("GITLAB_REVALIDATE_MAX_ENTRIES", "256"))
+GITLAB_REVALIDATE_MAX_BYTES = int(os.environ.get("GITLAB_REVALIDATE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Decode /changes responses incrementally instead of loading the whole body at once
+GITLAB_STREAM_CHANGES = os.environ.get("GITLAB_STREAM_CHANGES", "0").lower() in ("1", "true", "yes")
+# Size of the chunks read from streamed GitLab responses
+GITLAB_STREAM_CHUNK_SIZE = int(os.environ.get("GITLAB_STREAM_CHUNK_SIZE", str(256 * 1024)))
+# Largest merge request collected for the cache while it is read incrementally (streamed or paginated)
+GITLAB_STREAM_CACHE_MAX_BYTES = int(os.environ.get("GITLAB_STREAM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Endpoint used to list merge request changes: "changes" (single response) or "diffs" (paginated)
+GITLAB_DIFFS_ENDPOINT = os.environ.get("GITLAB_DIFFS_ENDPOINT", "changes")
+# Files per page requested from the paginated /diffs endpoint
+GITLAB_DIFFS_PER_PAGE = int(os.environ.get("GITLAB_DIFFS_PER_PAGE", "50"))
+# Fetch the next /diffs page while the current one is being processed
+GITLAB_DIFFS_PREFETCH = os.environ.get("GITLAB_DIFFS_PREFETCH", "1").lower() in ("1", "true", "yes")
+# Steady request rate and burst size allowed per GitLab host and token
+GITLAB_RATE_LIMIT = float(os.environ.get("GITLAB_RATE_LIMIT", "10"))
+GITLAB_RATE_BURST = int(os.environ.get("GITLAB_RATE_BURST", "20"))
+# Number of times a request answered with 429 Too Many Requests is retried
+GITLAB_MAX_RETRIES = int(os.environ.get("GITLAB_MAX_RETRIES", "3"))
+# JSON library used for JSON-RPC messages and tool results: auto, orjson, msgspec or json
+MCP_JSON_CODEC = os.environ.get("MCP_JSON_CODEC", "auto")
+# Pretty-print tool results with indent=2 instead of encoding them compactly
+MCP_PRETTY_JSON = os.environ.get("MCP_PRETTY_JSON", "0").lower() in ("1", "true", "yes")
+# Transport served by main(): "stdio" (line-delimited JSON), "http" (streamable HTTP with SSE)
+# or "daemon" (line-delimited JSON on MCP_DAEMON_SOCKET, normally started by the stdio shim)
+MCP_TRANSPORT = os.environ.get("MCP_TRANSPORT", "stdio")
+# Address and endpoint path of the HTTP transport; only local clients can connect by default
+MCP_HTTP_HOST = os.environ.get("MCP_HTTP_HOST", "127.0.0.1")
+MCP_HTTP_PORT = int(os.environ.get("MCP_HTTP_PORT", "8765"))
+MCP_HTTP_PATH = os.environ.get("MCP_HTTP_PATH", "/mcp")
+# HTTP client sessions kept at once; the least recently used is dropped beyond this
+MCP_HTTP_MAX_SESSIONS = int(os.environ.get("MCP_HTTP_MAX_SESSIONS", "1024"))
+# Unix socket of the shared daemon; when set, the stdio server forwards to it and starts it if needed
+MCP_DAEMON_SOCKET = os.environ.get("MCP_DAEMON_SOCKET")
+# Seconds the daemon keeps running without any connected client
+MCP_DAEMON_IDLE_TIMEOUT = float(os.environ.get("MCP_DAEMON_IDLE_TIMEOUT", "600"))
+# Seconds a shim and the daemon wait for each other's handshake line
+MCP_DAEMON_HANDSHAKE_TIMEOUT = float(os.environ.get("MCP_DAEMON_HANDSHAKE_TIMEOUT", "5"))
+# Minimum seconds between two progress notifications of a tool call
+MCP_PROGRESS_INTERVAL = float(os.environ.get("MCP_PROGRESS_INTERVAL", "0.25"))
+# Worker processes used to parse the diffs of very large merge requests; 0 or 1 parses inline
+GITLAB_PARSE_PROCESSES = int(os.environ.get("GITLAB_PARSE_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Total diff size of a merge request above which its diffs are parsed in worker processes
+GITLAB_PARSE_PARALLEL_MIN_BYTES = int(os.environ.get("GITLAB_PARSE_PARALLEL_MIN_BYTES", str(8 * 1024 * 1024)))
 
+# Outbound request priorities; writes are scheduled ahead of reads
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
 
-def fetch_mr_diff(mr_iid_arg):
-    encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
-    url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}/changes"
-    resp = requests.get(url, headers={"PRIVATE-TOKEN": GITLAB_TOKEN})
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_gitlab_session():
+    """Return the shared keep-alive session used for every GitLab API call"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Imported here so the stdio shim of the daemon mode starts without loading requests
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # pool_block caps concurrent connections per host at GITLAB_POOL_MAXSIZE
+            # instead of opening throwaway connections once the pool is exhausted
+            adapter = HTTPAdapter(
+                pool_connections=GITLAB_POOL_CONNECTIONS,
+                pool_maxsize=GITLAB_POOL_MAXSIZE,
+                pool_block=True
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept": "application/json",
+                "Connection": "keep-alive"
+            })
+            if GITLAB_TOKEN:
+                session.headers["PRIVATE-TOKEN"] = GITLAB_TOKEN
+            _session = session
+        return _session
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header given either in seconds or as an HTTP date"""
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CallCancelled(BaseException):
+    """Raised inside a tool call once the client has cancelled it.
+
+    Like KeyboardInterrupt it is not an Exception, so the per-item error
+    handling of the tools lets it through instead of carrying on.
+    """
+
+
+class CallContext:
+    """Cancellation and progress state of one in-flight tools/call request.
+
+    When the request carries a progressToken, work counted with add_progress
+    is reported to the client through send as notifications/progress.
+    """
+
+    def __init__(self, request_id, progress_token=None, send=None):
+        self.request_id = request_id
+        self.cancelled = threading.Event()
+        self._responses = set()
+        self._lock = threading.Lock()
+        self._send = send if progress_token is not None else None
+        self._progress_token = progress_token
+        self._stages = {}
+        self._progress = 0
+        self._progress_sent = 0.0
+        self._progress_reported = 0
+
+    def cancel(self):
+        """Mark the call cancelled and abort the GitLab responses it is reading"""
+        with self._lock:
+            self.cancelled.set()
+            responses, self._responses = self._responses, set()
+        for resp in responses:
+            abort_response(resp)
+
+    def check(self):
+        """Raise CallCancelled if the call has been cancelled"""
+        if self.cancelled.is_set():
+            raise CallCancelled()
+
+    def track(self, resp):
+        """Abort resp when the call is cancelled; it is closed right away if it already was"""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._responses.add(resp)
+                return
+        resp.close()
+        raise CallCancelled()
+
+    def untrack(self, resp):
+        with self._lock:
+            self._responses.discard(resp)
+
+    def add_progress(self, stage, files=0, nbytes=0, pages=0):
+        """Count work done in stage and notify the client of it.
+
+        Within a stage, notifications are sent at most every
+        MCP_PROGRESS_INTERVAL seconds. The progress value is the number of
+        bytes handled so far across all stages, and has no total since that is
+        not known up front; the message breaks the work down per stage in
+        pages, files and bytes.
+        """
+        if self._send is None:
+            return
+        with self._lock:
+            counts = self._stages.get(stage)
+            new_stage = counts is None
+            if new_stage:
+                counts = self._stages[stage] = [0, 0, 0]
+            counts[0] += pages
+            counts[1] += files
+            counts[2] += nbytes
+            self._progress += nbytes
+            now = time.monotonic()
+            # The progress value must increase from one notification to the next
+            if self._send is None or self._progress == self._progress_reported:
+                return
+            # The start of each stage that handles bytes is reported, however short the stage before it
+            if not new_stage and now - self._progress_sent < MCP_PROGRESS_INTERVAL:
+                return
+            self._progress_sent = now
+            self._progress_reported = self._progress
+            # Sent under the lock so that the notifications of one call stay in order
+            try:
+                self._send({
+                    "jsonrpc": "2.0",
+                    "method": "notifications/progress",
+                    "params": {
+                        "progressToken": self._progress_token,
+                        "progress": self._progress,
+                        "message": progress_message(self._stages)
+                    }
+                })
+            except OSError:
+                # A client that went away does not fail the call; it just gets no more progress
+                self._send = None
+
+    def end_progress(self):
+        """Stop progress notifications, which must not follow the response"""
+        with self._lock:
+            self._send = None
+
+
+def progress_message(stages):
+    """Describe per-stage [pages, files, bytes] counts, e.g. fetch: 2 pages, 80 files, 1048576 bytes"""
+    parts = []
+    for stage, (pages, files, nbytes) in stages.items():
+        counts = [f"{files} files", f"{nbytes} bytes"]
+        if pages:
+            counts.insert(0, f"{pages} pages")
+        parts.append(f"{stage}: " + ", ".join(counts))
+    return "; ".join(parts)
+
+
+class CallRegistry:
+    """In-flight tool calls of one client session, by JSON-RPC request id"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def start(self, request_id, progress_token=None, send=None):
+        context = CallContext(request_id, progress_token, send)
+        with self._lock:
+            try:
+                self._calls[request_id] = context
+            except TypeError:
+                pass  # Not a valid id, so nothing can refer to it to cancel it
+        return context
+
+    def finish(self, context):
+        with self._lock:
+            try:
+                if self._calls.get(context.request_id) is context:
+                    del self._calls[context.request_id]
+            except TypeError:
+                pass
+
+    def cancel(self, request_id):
+        """Cancel the call with request_id; unknown or finished ids are ignored"""
+        with self._lock:
+            try:
+                context = self._calls.get(request_id)
+            except TypeError:
+                context = None
+        if context is not None:
+            context.cancel()
+
+
+def abort_response(resp):
+    """Abort the download of a streamed response that another thread may be reading.
+
+    The socket is shut down rather than the response closed: a close waits for
+    a pending read to return, while a shutdown wakes it. The reading thread sees
+    the body end early and closes the response itself.
+    """
+    connection = getattr(resp.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+_call_state = threading.local()
+
+
+def current_call():
+    """Return the CallContext of the tool call running on this thread, or None"""
+    return getattr(_call_state, "context", None)
+
+
+def check_cancelled():
+    """Raise CallCancelled if the tool call running on this thread has been cancelled"""
+    context = getattr(_call_state, "context", None)
+    if context is not None:
+        context.check()
+
+
+def report_progress(stage, files=0, nbytes=0, pages=0):
+    """Count work done by the tool call running on this thread; see CallContext.add_progress"""
+    context = getattr(_call_state, "context", None)
+    if context is not None:
+        context.add_progress(stage, files, nbytes, pages)
+
+
+def run_in_call(context, fn, *args):
+    """Run fn(*args) on this thread on behalf of the tool call context"""
+    previous = current_call()
+    _call_state.context = context
+    try:
+        return fn(*args)
+    finally:
+        _call_state.context = previous
+
+
+class TokenBucket:
+    """Request budget of one GitLab host and token"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Monotonic time before which no request may be sent (Retry-After)
+        self.blocked_until = 0.0
+        # Monotonic time at which a rate lowered from RateLimit headers is restored
+        self.slowed_until = 0.0
+        self.waiting_writes = 0
+
+    def refill(self, now, default_rate):
+        if self.slowed_until and now >= self.slowed_until:
+            self.rate = default_rate
+            self.slowed_until = 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class OutboundScheduler:
+    """Paces outbound GitLab requests with a token bucket per (host, token).
+
+    The buckets follow the RateLimit-Remaining/RateLimit-Reset headers, spreading
+    what is left of the quota over the rest of the window, and honour Retry-After
+    so requests wait instead of failing with 429. Reads queued on a bucket yield
+    to waiting writes so that comment posts are not starved by speculative fetches.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self.delayed = 0
+        self.rate_limited = 0
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def acquire(self, key, priority=PRIORITY_READ):
+        """Block until a request for key may be sent"""
+        context = current_call()
+        with self._cond:
+            bucket = self._bucket(key)
+            is_write = priority == PRIORITY_WRITE
+            if is_write:
+                bucket.waiting_writes += 1
+            delayed = False
+            try:
+                while True:
+                    if context is not None:
+                        context.check()
+                    now = time.monotonic()
+                    bucket.refill(now, self.rate)
+                    ready = now >= bucket.blocked_until and bucket.tokens >= 1
+                    if ready and (is_write or not bucket.waiting_writes):
+                        bucket.tokens -= 1
+                        if delayed:
+                            self.delayed += 1
+                        return
+                    delayed = True
+                    wait = max(bucket.blocked_until - now, (1 - bucket.tokens) / bucket.rate, 0.001)
+                    # Cancelled calls stop waiting within a tenth of a second
+                    self._cond.wait(wait if context is None else min(wait, 0.1))
+            finally:
+                if is_write:
+                    bucket.waiting_writes -= 1
+                    self._cond.notify_all()
+
+    def update(self, key, resp):
+        """Adjust the bucket of key from the rate limit headers of a response"""
+        headers = resp.headers
+        with self._cond:
+            bucket = self._bucket(key)
+            now = time.monotonic()
+            retry_after = headers.get("Retry-After")
+            delay = retry_after_seconds(retry_after) if retry_after else None
+            remaining = headers.get("RateLimit-Remaining")
+            reset = headers.get("RateLimit-Reset")
+            if remaining is not None and reset is not None:
+                try:
+                    remaining = int(remaining)
+                    window = max(float(reset) - time.time(), 1.0)
+                except ValueError:
+                    remaining = None
+                if remaining is not None:
+                    # Spread the remaining quota over the rest of the window
+                    bucket.rate = min(self.rate, max(remaining / window, 1.0 / window))
+                    bucket.tokens = min(bucket.tokens, remaining)
+                    bucket.slowed_until = now + window
+                    if remaining <= 0 and delay is None:
+                        delay = window
+            if resp.status_code == 429:
+                self.rate_limited += 1
+                if delay is None:
+                    delay = 1.0
+            if delay is not None:
+                bucket.blocked_until = max(bucket.blocked_until, now + delay)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "buckets": len(self._buckets),
+                "delayed": self.delayed,
+                "rate_limited": self.rate_limited
+            }
+
+
+outbound_scheduler = OutboundScheduler(GITLAB_RATE_LIMIT, GITLAB_RATE_BURST)
+
+
+def gitlab_request(method, url, **kwargs):
+    """Send a request to the GitLab API over the shared session.
+
+    Every call is paced by the outbound scheduler, and responses answered with
+    429 Too Many Requests are retried once the scheduler allows it.
+
+    Inside a tool call the body is always streamed, so that cancelling the
+    call closes the response mid-download; responses not requested with
+    stream=True are read completely before they are returned.
+    """
+    priority = PRIORITY_READ if method in ("GET", "HEAD") else PRIORITY_WRITE
+    key = (urllib.parse.urlsplit(url).netloc, GITLAB_TOKEN)
+    session = get_gitlab_session()
+    context = current_call()
+    stream = kwargs.pop("stream", False)
+    attempt = 0
+    while True:
+        outbound_scheduler.acquire(key, priority)
+        resp = session.request(method, url, stream=stream or context is not None, **kwargs)
+        if context is not None:
+            context.track(resp)
+            if not stream:
+                read_body(context, resp)
+        outbound_scheduler.update(key, resp)
+        if resp.status_code != 429 or attempt >= GITLAB_MAX_RETRIES:
+            return resp
+        resp.close()
+        attempt += 1
+
+
+def read_body(context, resp):
+    """Read the whole body of a streamed response on behalf of a cancellable call.
+
+    The body is read in chunks, so the download is reported as progress and
+    stops as soon as the call is cancelled.
+    """
+    chunks = []
+    try:
+        for chunk in resp.iter_content(GITLAB_STREAM_CHUNK_SIZE):
+            context.check()
+            context.add_progress("fetch", nbytes=len(chunk))
+            chunks.append(chunk)
+        # An aborted download may also end early without an error
+        context.check()
+    except BaseException:
+        resp.close()
+        context.untrack(resp)
+        context.check()
+        raise
+    # Keep the body where requests keeps it for a response sent without stream=True
+    resp._content = b"".join(chunks)
+    context.untrack(resp)
+
+
+class RevalidationStore:
+    """LRU store of parsed GitLab responses along with their ETag/Last-Modified validators.
+
+    Sizes are measured on the encoded body, and entries beyond max_entries or
+    max_bytes are evicted least recently used first.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.not_modified = 0
+        self.modified = 0
+
+    def get(self, url):
+        """Return (etag, last_modified, body) stored for url, or None"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            self._entries.move_to_end(url)
+            return entry[:3]
+
+    def put(self, url, etag, last_modified, body, size):
+        with self._lock:
+            if url in self._entries:
+                self._bytes -= self._entries.pop(url)[3]
+            if size > self.max_bytes:
+                return
+            self._entries[url] = (etag, last_modified, body, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][3]
+
+    def record(self, not_modified):
+        with self._lock:
+            if not_modified:
+                self.not_modified += 1
+            else:
+                self.modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "not_modified": self.not_modified,
+                "modified": self.modified
+            }
+
+
+revalidation_store = RevalidationStore(GITLAB_REVALIDATE_MAX_ENTRIES, GITLAB_REVALIDATE_MAX_BYTES)
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result or exception. When the
+    tool call of the first caller is cancelled, a waiting caller runs it again;
+    a waiting caller whose own call is cancelled stops waiting.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = self._Call()
+                    self.calls += 1
+                else:
+                    self.shared += 1
+            if leader:
+                break
+            context = current_call()
+            if context is None:
+                call.done.wait()
+            else:
+                # A cancelled follower stops waiting within a tenth of a second and frees its worker
+                while not call.done.wait(0.1):
+                    context.check()
+            if isinstance(call.error, CallCancelled):
+                # The leader's client gave up, not ours: run it again
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "calls": self.calls,
+                "shared": self.shared
+            }
+
+
+read_flights = SingleFlight()
+
+
+def gitlab_get_json(url):
+    """GET a GitLab API resource and return its parsed JSON body.
+
+    Concurrent reads of the same URL share one HTTP call and its decoded body.
+    Responses carrying an ETag or Last-Modified header are kept, and later
+    requests for the same URL send If-None-Match/If-Modified-Since so that a
+    304 reuses the stored body instead of transferring and decoding it again.
+    The returned object may be shared between callers and must not be mutated.
+    """
+    return read_flights.do(url, fetch_json_revalidated, url)
+
+
+def fetch_json_revalidated(url):
+    """GET url, revalidating a stored copy of the response when there is one"""
+    stored = revalidation_store.get(url)
+    headers = {}
+    if stored is not None:
+        etag, last_modified, body = stored
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    resp = gitlab_request("GET", url, headers=headers)
+    if resp.status_code == 304 and stored is not None:
+        revalidation_store.record(not_modified=True)
+        return body
     resp.raise_for_status()
     data = resp.json()
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if etag or last_modified:
+        revalidation_store.record(not_modified=False)
+        revalidation_store.put(url, etag, last_modified, data, len(resp.content))
+    return data
+
+
+_JSON_SPECIAL_RE = re.compile(r'["\[\]{}]')
+# Body of a JSON string up to its closing quote, or up to the end of the buffer
+_JSON_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+_JSON_KEY_VALUE_RE = re.compile(r'\s*:\s*(\S)')
+_JSON_ITEM_START_RE = re.compile(r'[\s,]*(\S)')
+
+
+def iter_response_text(resp, chunk_size=None):
+    """Yield the body of a streamed response as UTF-8 decoded text fragments"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in resp.iter_content(chunk_size=chunk_size or GITLAB_STREAM_CHUNK_SIZE):
+        check_cancelled()
+        report_progress("fetch", nbytes=len(chunk))
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_json_array_items(chunks, key):
+    """Incrementally decode the items of the array stored under key in a top-level JSON object.
+
+    chunks is an iterable of text fragments. Text before the array is scanned
+    and dropped, and each item is decoded as soon as it is complete and then
+    released, so peak memory is bounded by the largest item rather than by
+    the whole document. Yields nothing if the object has no such key.
+    """
+    chunks = iter(chunks)
+    decoder = json.JSONDecoder()
+    target = json.dumps(key)
+    buf = ""
+    pos = 0
+
+    # Phase 1: scan the enclosing object for the key, tracking nesting and strings
+    depth = 0
+    in_string = False
+    string_start = None  # start of a depth 1 string that may still be the key
+    key_end = None  # end of a depth 1 string equal to the key
+    while True:
+        need_more = False
+        if key_end is not None:
+            match = _JSON_KEY_VALUE_RE.match(buf, key_end)
+            if match is None:
+                if buf[key_end:].strip() in ("", ":"):
+                    need_more = True
+                else:
+                    key_end = None  # the string was a value, not a key
+            elif match.group(1) == "[":
+                pos = match.end()
+                break
+            else:
+                key_end = None  # the key holds something other than an array
+        elif in_string:
+            pos = _JSON_STRING_BODY_RE.match(buf, pos).end()
+            if pos >= len(buf) or buf[pos] != '"':
+                need_more = True
+            else:
+                pos += 1
+                in_string = False
+                if string_start is not None and buf[string_start:pos] == target:
+                    key_end = pos
+                string_start = None
+            if string_start is not None and pos - string_start > len(target):
+                string_start = None
+        else:
+            match = _JSON_SPECIAL_RE.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                need_more = True
+            else:
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    in_string = True
+                    string_start = match.start() if depth == 1 else None
+                elif char in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+        if need_more:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            cut = min(x for x in (pos, string_start, key_end) if x is not None)
+            buf = buf[cut:] + chunk
+            pos -= cut
+            if string_start is not None:
+                string_start -= cut
+            if key_end is not None:
+                key_end -= cut
+
+    # Phase 2: decode one array item at a time
+    buf = buf[pos:]
+    pos = 0
+    while True:
+        match = _JSON_ITEM_START_RE.match(buf, pos)
+        item_start = match.start(1) if match else None
+        item_end = None
+        if match is not None and match.group(1) == "]":
+            return
+        if match is not None and match.group(1) in "{[":
+            # Find the end of the item by tracking nesting outside of strings
+            scan = item_start
+            item_depth = 0
+            in_string = False
+            while item_end is None:
+                need_more = False
+                if in_string:
+                    scan = _JSON_STRING_BODY_RE.match(buf, scan).end()
+                    if scan >= len(buf) or buf[scan] != '"':
+                        need_more = True
+                    else:
+                        scan += 1
+                        in_string = False
+                else:
+                    match = _JSON_SPECIAL_RE.search(buf, scan)
+                    if match is None:
+                        scan = len(buf)
+                        need_more = True
+                    else:
+                        char = match.group()
+                        scan = match.end()
+                        if char == '"':
+                            in_string = True
+                        elif char in "{[":
+                            item_depth += 1
+                        else:
+                            item_depth -= 1
+                            if item_depth == 0:
+                                item_end = scan
+                if need_more:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        raise ValueError(f"Truncated JSON array under key {key!r}")
+                    # Keep only the item being decoded
+                    buf = buf[item_start:] + chunk
+                    scan -= item_start
+                    item_start = 0
+        elif match is not None:
+            # Scalar item: complete once a delimiter follows it, so that a number
+            # split across chunks is not decoded early
+            try:
+                value, item_end = decoder.raw_decode(buf, item_start)
+            except json.JSONDecodeError:
+                item_end = None
+            if item_end is not None and item_end < len(buf) and buf[item_end] in " \t\r\n,]":
+                yield value
+                buf = buf[item_end:]
+                pos = 0
+                continue
+            item_end = None
+        if item_end is None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError(f"Truncated JSON array under key {key!r}")
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        value, item_end = decoder.raw_decode(buf, item_start)
+        buf = buf[item_end:]
+        pos = 0
+        yield value
+
+
+def changes_size(changes):
+    """Approximate the memory held by a list of changes, dominated by the diff text"""
+    return sum(len(c.get("diff") or "") + len(c.get("new_path") or "") + len(c.get("old_path") or "")
+               for c in changes)
+
+
+class MRChangesCache:
+    """Thread-safe LRU cache of merge request changes keyed by (project, mr_iid, head_sha).
+
+    Entries expire after ttl seconds and the least recently used ones are evicted
+    once either max_entries or max_bytes is exceeded. Storing a newer head_sha for
+    a merge request drops the entries of its previous pushes. Changes too large
+    to keep leave an entry without them, which still holds derived artifacts.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._heads = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached changes for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_derived(self, key, name):
+        """Return the artifact stored under name alongside the entry for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                return None
+            return entry[3].get(name)
+
+    def recent_head_sha(self, project, mr_iid, max_age=None):
+        """Return the head_sha of the cached entry of a merge request, or None.
+
+        With max_age, the head must have been stored or confirmed against
+        GitLab within the last max_age seconds.
+        """
+        with self._lock:
+            head = self._heads.get((project, mr_iid))
+            if head is None or (max_age is not None and time.monotonic() - head[1] > max_age):
+                return None
+            return head[0]
+
+    def confirm_head_sha(self, project, mr_iid, head_sha):
+        """Record that GitLab still reports head_sha for the merge request"""
+        with self._lock:
+            if (project, mr_iid, head_sha) in self._entries:
+                self._heads[(project, mr_iid)] = (head_sha, time.monotonic())
+
+    def put_derived(self, key, name, value, size):
+        """Store an artifact computed from the changes of key, counted against max_bytes.
+
+        It is dropped together with the entry; nothing is stored when key is no
+        longer cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or name in entry[3]:
+                return
+            entry[3][name] = value
+            self._entries[key] = (entry[0], entry[1] + size, entry[2], entry[3])
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def put(self, key, changes):
+        """Store changes for key, evicting older pushes and least recently used entries.
+
+        changes is None, or larger than max_bytes, for a merge request too
+        large to cache; only the key is recorded then, for put_derived.
+        """
+        size = changes_size(changes) if changes is not None else 0
+        if size > self.max_bytes:
+            changes, size = None, 0
+        with self._lock:
+            project, mr_iid = key[0], key[1]
+            for stale_key in [k for k in self._entries if k[0] == project and k[1] == mr_iid]:
+                self._remove(stale_key)
+            self._entries[key] = (changes, size, time.monotonic() + self.ttl, {})
+            self._heads[(project, mr_iid)] = (key[2], time.monotonic())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._heads.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+        head = self._heads.get((key[0], key[1]))
+        if head is not None and head[0] == key[2]:
+            del self._heads[(key[0], key[1])]
+
+
+mr_changes_cache = MRChangesCache(MR_CACHE_MAX_ENTRIES, MR_CACHE_MAX_BYTES, MR_CACHE_TTL)
+
+
+def iter_mr_changes(mr_iid_arg, project_path_arg=None, head_sha_arg=None):
+    """Yield the file changes of a merge request one at a time, cached per head commit.
+
+    On a cache miss the changes come from the endpoint picked by
+    GITLAB_DIFFS_ENDPOINT. The paginated /diffs endpoint is read page by page;
+    with GITLAB_STREAM_CHANGES enabled the /changes response is decoded
+    incrementally. Either way each change reaches the caller while the rest is
+    still downloading and the whole listing is never held at once.
+
+    head_sha_arg skips the head lookup when the caller has just resolved it.
+    Otherwise a merge request read within the last MR_CACHE_HEAD_TTL seconds
+    is served from the cache without any request. An older cached copy costs
+    one small MR details request (usually a 304) to notice a new push. On a
+    cold miss the /changes endpoint is read directly; the paginated and
+    streamed reads first look up the head, since their payloads do not carry it.
+    """
+    project_path = project_path_arg or GITLAB_PROJECT_PATH
+    mr_key = str(mr_iid_arg)
+    head_sha = head_sha_arg or mr_changes_cache.recent_head_sha(project_path, mr_key, MR_CACHE_HEAD_TTL)
+    incremental = GITLAB_DIFFS_ENDPOINT == "diffs" or GITLAB_STREAM_CHANGES
+    if head_sha is None and (incremental or mr_changes_cache.recent_head_sha(project_path, mr_key) is not None):
+        head_sha = resolve_head_sha(mr_iid_arg, project_path)
+    key = (project_path, mr_key, head_sha)
+    changes = mr_changes_cache.get(key) if head_sha else None
+    if changes is not None:
+        yield from changes
+        return
+    encoded_path = urllib.parse.quote_plus(project_path)
+    if GITLAB_DIFFS_ENDPOINT == "diffs":
+        url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}/diffs"
+        yield from cache_changes_as_read(iter_mr_diffs_pages(url), key if head_sha else None)
+        return
+    url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}/changes"
+    if GITLAB_STREAM_CHANGES:
+        yield from cache_changes_as_read(stream_mr_changes(url), key if head_sha else None)
+        return
+    data = gitlab_get_json(url)
+    changes = data.get("changes", [])
+    report_progress("fetch", files=len(changes))
+    # Key by the head the payload was computed for, in case of a push in between
+    head_sha = (data.get("diff_refs") or {}).get("head_sha") or head_sha
+    if head_sha:
+        mr_changes_cache.put((project_path, str(mr_iid_arg), head_sha), changes)
+    yield from changes
+
+
+def cache_changes_as_read(changes, cache_key):
+    """Pass changes through while collecting them for the cache under cache_key.
+
+    Collection stops once the changes exceed GITLAB_STREAM_CACHE_MAX_BYTES (or
+    the cache byte budget, if smaller), after which each change is released as
+    soon as the caller is done with it. Nothing is stored unless the changes
+    were read to the end.
+    """
+    collected = [] if cache_key is not None else None
+    max_bytes = min(GITLAB_STREAM_CACHE_MAX_BYTES, mr_changes_cache.max_bytes)
+    size = 0
+    for change in changes:
+        check_cancelled()
+        report_progress("fetch", files=1)
+        if collected is not None:
+            size += changes_size((change,))
+            if size <= max_bytes:
+                collected.append(change)
+            else:
+                collected = None
+        yield change
+    # A cancelled download can end early without an error; never cache part of it
+    check_cancelled()
+    if cache_key is not None:
+        # Without collected changes, the key is still recorded for what is derived from them
+        mr_changes_cache.put(cache_key, collected)
+
+
+def stream_mr_changes(url):
+    """Stream the changes array of a /changes response, yielding one change at a time"""
+    resp = gitlab_request("GET", url, stream=True)
+    try:
+        resp.raise_for_status()
+        yield from iter_json_array_items(iter_response_text(resp), "changes")
+    except Exception:
+        # Reading fails once a cancel has closed the response
+        check_cancelled()
+        raise
+    finally:
+        resp.close()
+
+
+def fetch_mr_diffs_page(url, page, per_page):
+    """Fetch one page of a /diffs listing and return (diffs, next_page)"""
+    resp = gitlab_request("GET", url, params={"page": page, "per_page": per_page})
+    resp.raise_for_status()
+    report_progress("fetch", pages=1)
+    diffs = resp.json()
+    next_page = resp.headers.get("X-Next-Page")
+    if next_page is None:
+        # Without pagination headers, a full page means there may be more
+        next_page = page + 1 if len(diffs) >= per_page else None
+    return diffs, int(next_page) if next_page else None
+
+
+def iter_mr_diffs_pages(url, per_page=None, prefetch=None):
+    """Yield the file diffs of a paginated /merge_requests/:iid/diffs listing.
+
+    Large merge requests come back complete, one page at a time. When prefetch
+    is enabled the next page is requested while the current one is consumed.
+    """
+    per_page = per_page or GITLAB_DIFFS_PER_PAGE
+    prefetch = GITLAB_DIFFS_PREFETCH if prefetch is None else prefetch
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mcp-prefetch") if prefetch else None
+    try:
+        diffs, next_page = fetch_mr_diffs_page(url, 1, per_page)
+        while True:
+            pending = None
+            if next_page is not None and executor is not None:
+                pending = executor.submit(run_in_call, current_call(), fetch_mr_diffs_page, url, next_page, per_page)
+            yield from diffs
+            if next_page is None:
+                return
+            if pending is not None:
+                diffs, next_page = pending.result()
+            else:
+                diffs, next_page = fetch_mr_diffs_page(url, next_page, per_page)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def fetch_mr_changes(mr_iid_arg, project_path_arg=None, head_sha_arg=None):
+    """Return the file changes of a merge request as a list"""
+    return list(iter_mr_changes(mr_iid_arg, project_path_arg, head_sha_arg))
+
+
+def fetch_mr_head_sha(mr_iid_arg, project_path_arg=None):
+    """Return the head commit the merge request diff is currently computed for"""
+    mr_details = fetch_mr_details(mr_iid_arg, project_path_arg)
+    return (mr_details.get("diff_refs") or {}).get("head_sha")
+
+
+def resolve_head_sha(mr_iid_arg, project_path):
+    """Return the head commit of a merge request, trusting a cached one for MR_CACHE_HEAD_TTL seconds"""
+    head_sha = mr_changes_cache.recent_head_sha(project_path, str(mr_iid_arg), MR_CACHE_HEAD_TTL)
+    if head_sha is None:
+        head_sha = fetch_mr_head_sha(mr_iid_arg, project_path)
+        mr_changes_cache.confirm_head_sha(project_path, str(mr_iid_arg), head_sha)
+    return head_sha
+
+
+def glob_to_regex(pattern):
+    """Translate a path glob into a compiled regex.
+
+    * and ? do not cross directory separators, ** matches any number of
+    directories, and a pattern without a slash matches the file name in any
+    directory, like .gitignore patterns.
+    """
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.lstrip("/")
+    parts = [] if anchored else ["(?:.*/)?"]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            i += 2
+            if pattern.startswith("/", i):
+                i += 1
+                parts.append("(?:.*/)?")
+            else:
+                parts.append(".*")
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body.replace("\\", "\\\\").replace("[", "\\[") + "]")
+            i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return re.compile("".join(parts) + r"\Z")
+
+
+def glob_escape(path):
+    """Quote the glob metacharacters of a literal path, so that the pattern matches only that path"""
+    return re.sub(r"([*?\[])", r"[\1]", path)
+
+
+def glob_list(value, name):
+    """Return the globs of a filter argument; a single glob may be given as a bare string"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, (list, tuple)) or not all(isinstance(p, str) for p in value):
+        raise ValueError(f"{name} must be a glob or a list of globs")
+    return list(value)
+
+
+class FileFilter:
+    """Selects merge request files by include/exclude path globs and diff size.
+
+    A file is kept when it matches any include glob (or there are none) and no
+    exclude glob; renamed files are matched on both their old and new path.
+    Kept files whose diff is larger than max_diff_bytes_per_file come through
+    with an empty diff and their original size in omitted_diff_bytes, so they
+    are neither parsed nor serialized.
+    """
+
+    def __init__(self, include=None, exclude=None, max_diff_bytes_per_file=None):
+        self.include = glob_list(include, "include")
+        self.exclude = glob_list(exclude, "exclude")
+        self.max_diff_bytes_per_file = max_diff_bytes_per_file
+        self._include = [glob_to_regex(p) for p in self.include]
+        self._exclude = [glob_to_regex(p) for p in self.exclude]
+
+    @classmethod
+    def from_params(cls, params):
+        """Build a filter from tool arguments, or return None when none were given"""
+        include = params.get("include")
+        exclude = params.get("exclude")
+        max_bytes = params.get("max_diff_bytes_per_file")
+        if not (include or exclude or max_bytes):
+            return None
+        return cls(include, exclude, max_bytes)
+
+    def to_params(self):
+        return {
+            "include": self.include,
+            "exclude": self.exclude,
+            "max_diff_bytes_per_file": self.max_diff_bytes_per_file
+        }
+
+    def matches(self, change):
+        paths = {change.get("new_path"), change.get("old_path")}
+        paths.discard(None)
+        if self._include and not any(r.match(path) for r in self._include for path in paths):
+            return False
+        return not any(r.match(path) for r in self._exclude for path in paths)
+
+    def apply(self, changes):
+        """Yield the selected changes, with oversized diffs emptied"""
+        for change in changes:
+            if not self.matches(change):
+                continue
+            diff_bytes = len(change.get("diff") or "")
+            if self.max_diff_bytes_per_file and diff_bytes > self.max_diff_bytes_per_file:
+                change = dict(change, diff="", omitted_diff_bytes=diff_bytes)
+            yield change
+
+
+def diff_entry(change):
+    """Shape a change into the {file, diff} entry returned by the diff tools"""
+    entry = {"file": change["new_path"], "diff": change["diff"]}
+    if "omitted_diff_bytes" in change:
+        entry["omitted_diff_bytes"] = change["omitted_diff_bytes"]
+    return entry
+
+
+def fetch_mr_diff(mr_iid_arg, project_path_arg=None, file_filter=None):
+    changes = iter_mr_changes(mr_iid_arg, project_path_arg)
+    if file_filter is not None:
+        changes = file_filter.apply(changes)
     # Return a clean list of file and diff only
-    return [{"file": c["new_path"], "diff": c["diff"]} for c in data.get("changes", [])]
+    return [diff_entry(c) for c in changes]
+
+
+def encode_cursor(state):
+    """Encode pagination state as an opaque cursor string"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def fetch_mr_diff_page(mr_iid_arg, cursor=None, page_size=None, max_page_bytes=None, project_path_arg=None,
+                       file_filter=None):
+    """Return one page of a merge request diff and the cursor of the next page.
+
+    A page holds at most page_size files and, past its first file, at most
+    max_page_bytes of diff text. The cursor pins the head commit of the first
+    page, so later pages come from the cached changes of that same commit
+    without another GitLab fetch, and fail if the merge request was pushed to
+    in between and the cached copy is gone. The cursor also carries the file
+    filter of the first page, which later pages reuse.
+    """
+    project_path = project_path_arg or GITLAB_PROJECT_PATH
+    offset = 0
+    if cursor:
+        state = decode_cursor(cursor)
+        if state.get("p") != project_path or state.get("i") != str(mr_iid_arg):
+            raise ValueError("Cursor does not belong to this merge request")
+        head_sha, offset = state.get("h"), state.get("o", 0)
+        file_filter = FileFilter(**state["f"]) if state.get("f") else None
+        changes = mr_changes_cache.get((project_path, str(mr_iid_arg), head_sha)) if head_sha else None
+        if changes is None:
+            current_head_sha = fetch_mr_head_sha(mr_iid_arg, project_path)
+            if current_head_sha != head_sha:
+                raise ValueError("Merge request changed since the cursor was issued; start again without a cursor")
+            changes = fetch_mr_changes(mr_iid_arg, project_path, head_sha)
+    else:
+        head_sha = resolve_head_sha(mr_iid_arg, project_path)
+        changes = fetch_mr_changes(mr_iid_arg, project_path, head_sha)
+    if file_filter is not None:
+        changes = list(file_filter.apply(changes))
+
+    files = []
+    page_bytes = 0
+    end = offset
+    while end < len(changes):
+        if page_size and len(files) >= page_size:
+            break
+        change = changes[end]
+        diff_bytes = len(change["diff"] or "")
+        if max_page_bytes and files and page_bytes + diff_bytes > max_page_bytes:
+            break
+        files.append(diff_entry(change))
+        page_bytes += diff_bytes
+        end += 1
+    next_cursor = None
+    if end < len(changes):
+        state = {"p": project_path, "i": str(mr_iid_arg), "h": head_sha, "o": end}
+        if file_filter is not None:
+            state["f"] = file_filter.to_params()
+        next_cursor = encode_cursor(state)
+    return {
+        "files": files,
+        "total_files": len(changes),
+        "next_cursor": next_cursor
+    }
+
+
+# Files ranked last when a diff has to be cut down to an output budget
+LOW_SIGNAL_GLOBS = [glob_to_regex(p) for p in (
+    "*.lock", "package-lock.json", "pnpm-lock.yaml", "go.sum", "**/vendor/**", "**/node_modules/**",
+    "**/dist/**", "*.min.js", "*.min.css", "*.map", "*.pb.go", "*_pb2.py", "*.snap", "*.svg",
+)]
+
+
+def is_low_signal(change):
+    """Whether a change is a lockfile, vendored, generated or minified file"""
+    return any(r.match(change["new_path"]) for r in LOW_SIGNAL_GLOBS)
+
+
+def first_line(text, start, end):
+    """Return the line of text starting at offset start, looking no further than end"""
+    newline = text.find("\n", start, end)
+    return text[start:end if newline == -1 else newline]
+
+
+def json_size(obj, indent):
+    """Size of obj in the output of format_result when nested indent spaces deep, including its separator"""
+    if MCP_PRETTY_JSON:
+        text = json.dumps(obj, indent=2)
+        return len(text) + indent * (text.count("\n") + 1) + 2
+    return len(stdlib_json_encode(obj)) + 1
+
+
+def budget_mr_diff(changes, max_output_bytes):
+    """Cut a merge request diff down to about max_output_bytes of JSON output.
+
+    Files are ranked with low-signal and deleted files last, then smallest
+    first, and whole hunks are kept in that order while they fit. Files keep
+    their original order in the output. A file that lost some hunks lists
+    them in omitted_hunks; a file that kept none moves to omitted_files with
+    its stats. Both carry fetch arguments for reading the file on its own.
+    Sizes are those of the output of format_result, which is compact unless
+    MCP_PRETTY_JSON is set.
+    """
+    encode = json.encoder.encode_basestring_ascii
+    changes = list(changes)
+    # JSON-escaped size of each diff, which is what the output actually carries; no diff is encoded twice
+    sizes = [len(encode(c["diff"] or "")) - 2 for c in changes]
+    result = {"files": [], "omitted_files": [], "total_files": len(changes), "truncated": False}
+    entry_sizes = [json_size(dict(diff_entry(c), diff=""), 4) + size for c, size in zip(changes, sizes)]
+    if json_size(result, 0) + sum(entry_sizes) <= max_output_bytes:
+        result["files"] = [diff_entry(c) for c in changes]
+        return result
+
+    result.update(truncated=True, unlisted_files=len(changes))
+    remaining = max_output_bytes - json_size(result, 0) - 16
+    # Every listed file costs at least its stub, so stubs are reserved up front
+    fetches = [{"include": ["/" + glob_escape(c["new_path"])]} for c in changes]
+    listed = 0
+    while listed < len(changes):
+        change = changes[listed]
+        stub = {"file": change["new_path"], "diff_bytes": sizes[listed], "hunks": 0, "additions": 0, "deletions": 0,
+                "fetch": fetches[listed]}
+        partial = {"file": change["new_path"], "diff": "", "omitted_hunks": [], "fetch": fetches[listed]}
+        cost = max(json_size(stub, 4) + 24, json_size(partial, 4) + 8)
+        if cost > remaining:
+            break
+        remaining -= cost
+        listed += 1
+
+    order = sorted(range(listed),
+                   key=lambda i: (is_low_signal(changes[i]), bool(changes[i].get("deleted_file")), sizes[i]))
+    kept = {}
+    for i in order:
+        diff = changes[i]["diff"] or ""
+        hunks = list(diff_parser.iter_hunks(diff))
+        summaries = [
+            {"header": first_line(diff, start, end), "additions": additions, "deletions": deletions}
+            for start, end, additions, deletions in hunks
+        ]
+        # The summaries of dropped hunks take space too, so they are reserved until a hunk is kept
+        summary_costs = [json_size(summary, 8) for summary in summaries]
+        keep = [False] * len(hunks)
+        if sum(summary_costs) <= remaining:
+            remaining -= sum(summary_costs)
+            for h, (start, end, _, _) in enumerate(hunks):
+                cost = len(encode(diff[start:end])) - 2
+                if cost <= remaining:
+                    remaining -= cost - summary_costs[h]
+                    keep[h] = True
+            if not any(keep):
+                remaining += sum(summary_costs)
+        kept[i] = (hunks, keep, summaries)
+
+    for i in range(listed):
+        change = changes[i]
+        diff = change["diff"] or ""
+        hunks, keep, summaries = kept[i]
+        if all(keep):
+            result["files"].append(diff_entry(change))
+        elif any(keep):
+            entry = diff_entry(change)
+            entry["diff"] = "".join(diff[start:end] for (start, end, _, _), k in zip(hunks, keep) if k)
+            entry["omitted_hunks"] = [summary for summary, k in zip(summaries, keep) if not k]
+            entry["fetch"] = fetches[i]
+            result["files"].append(entry)
+        else:
+            result["omitted_files"].append({
+                "file": change["new_path"],
+                "diff_bytes": len(diff),
+                "hunks": len(hunks),
+                "additions": sum(h[2] for h in hunks),
+                "deletions": sum(h[3] for h in hunks),
+                "fetch": fetches[i]
+            })
+    if listed < len(changes):
+        # Not even the stubs fit; the rest can be paged through with cursors
+        result["unlisted_files"] = len(changes) - listed
+    else:
+        del result["unlisted_files"]
+    return result
+
+
+def fetch_mr_diff_budgeted(mr_iid_arg, max_output_bytes, project_path_arg=None, file_filter=None):
+    """Return the diff of a merge request cut down to about max_output_bytes, see budget_mr_diff"""
+    changes = iter_mr_changes(mr_iid_arg, project_path_arg)
+    if file_filter is not None:
+        changes = file_filter.apply(changes)
+    return budget_mr_diff(changes, max_output_bytes)
+
+
+def file_diff_stats(change):
+    """Summarize one change as path, line counts and flags, without its diff body"""
+    diff = change.get("diff") or ""
+    additions = 0
+    deletions = 0
+    hunks = 0
+    for start, end, hunk_additions, hunk_deletions in diff_parser.iter_hunks(diff):
+        additions += hunk_additions
+        deletions += hunk_deletions
+        hunks += 1
+    return {
+        "path": change["new_path"],
+        "old_path": change.get("old_path"),
+        "new_path": change["new_path"],
+        "additions": additions,
+        "deletions": deletions,
+        "hunks": hunks,
+        "diff_bytes": len(diff),
+        "new_file": bool(change.get("new_file")),
+        "renamed_file": bool(change.get("renamed_file")),
+        "deleted_file": bool(change.get("deleted_file")),
+        # GitLab has no binary flag; binary files come with a one-line placeholder diff
+        "binary": diff.startswith("Binary files ") or diff.startswith("GIT binary patch"),
+        "too_large": bool(change.get("too_large"))
+    }
+
+
+def get_mr_diff_stats(mr_iid_arg, project_path_arg=None, head_sha_arg=None):
+    """Return the per-file stats of a merge request, kept with its cached changes"""
+    project_path = project_path_arg or GITLAB_PROJECT_PATH
+    head_sha = head_sha_arg or resolve_head_sha(mr_iid_arg, project_path)
+    key = (project_path, str(mr_iid_arg), head_sha)
+    stats = mr_changes_cache.get_derived(key, "diff_stats")
+    if stats is None:
+        stats = [file_diff_stats(c) for c in iter_mr_changes(mr_iid_arg, project_path, head_sha)]
+        size = sum(len(f["new_path"]) + len(f["old_path"] or "") + 256 for f in stats)
+        mr_changes_cache.put_derived(key, "diff_stats", stats, size)
+    return stats
+
+
+def fetch_mr_diff_stats(mr_iid_arg, project_path_arg=None, file_filter=None):
+    """Return the stats of the files selected by file_filter and their totals"""
+    files = get_mr_diff_stats(mr_iid_arg, project_path_arg)
+    if file_filter is not None:
+        files = [f for f in files if file_filter.matches(f)]
+    return {
+        "files": files,
+        "total_files": len(files),
+        "additions": sum(f["additions"] for f in files),
+        "deletions": sum(f["deletions"] for f in files)
+    }
+
+
+def fetch_mr_details(mr_iid_arg, project_path_arg=None):
+    """Fetch merge request details including diff_refs needed for inline comments"""
+    encoded_path = urllib.parse.quote_plus(project_path_arg or GITLAB_PROJECT_PATH)
+    url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}"
+    return gitlab_get_json(url)
+
+
+def fetch_mr_diffs(merge_requests, max_concurrency=None):
+    """Fetch the diffs of several merge requests in parallel.
+
+    merge_requests is a list of dicts with project_path and mr_iid. Results are
+    returned in input order, each tagged with its project and IID; a failing
+    merge request gets an error entry and does not affect the others.
+    """
+    results = []
+    if not merge_requests:
+        return results
+    workers = min(max_concurrency or GITLAB_FETCH_CONCURRENCY, len(merge_requests))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mcp-fetch") as pool:
+        futures = [
+            pool.submit(run_in_call, current_call(), fetch_mr_diff, mr["mr_iid"], mr.get("project_path"))
+            for mr in merge_requests
+        ]
+        for mr, future in zip(merge_requests, futures):
+            result = {
+                "project_path": mr.get("project_path") or GITLAB_PROJECT_PATH,
+                "mr_iid": mr["mr_iid"]
+            }
+            try:
+                result["diff"] = future.result()
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+    return results
+
+
+# Line type codes stored in ParsedDiff.types, indexing LINE_TYPE_NAMES
+LINE_OLD = 0
+LINE_NEW = 1
+LINE_TYPE_NAMES = ("old", "new")
+
+
+class ParsedDiff:
+    """Commentable lines of one file diff, held in compact typed arrays.
+
+    Each line is a type code, a line number and the start/end offsets of its
+    content within the original diff string, so no per-line objects or
+    content copies are made until a caller asks for them.
+    """
+
+    __slots__ = ("diff", "types", "line_numbers", "starts", "ends")
+
+    def __init__(self, diff):
+        self.diff = diff
+        self.types = array("B")
+        self.line_numbers = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+
+    @classmethod
+    def from_arrays(cls, diff, arrays):
+        """Rebuild a ParsedDiff of diff from the arrays returned by ParsedDiff.arrays"""
+        parsed = cls(diff)
+        parsed.types, parsed.line_numbers, parsed.starts, parsed.ends = arrays
+        return parsed
+
+    def arrays(self):
+        return self.types, self.line_numbers, self.starts, self.ends
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self.line(index)
+
+    def content(self, index):
+        return self.diff[self.starts[index]:self.ends[index]]
+
+    def line(self, index):
+        """Return line index in the {type, line_number, content} dict form"""
+        return {
+            'type': LINE_TYPE_NAMES[self.types[index]],
+            'line_number': self.line_numbers[index],
+            'content': self.diff[self.starts[index]:self.ends[index]]
+        }
+
+    def to_dicts(self):
+        """Return all lines in the {type, line_number, content} dict form"""
+        diff = self.diff
+        return [
+            {'type': LINE_TYPE_NAMES[line_type], 'line_number': line_number, 'content': diff[start:end]}
+            for line_type, line_number, start, end in zip(self.types, self.line_numbers, self.starts, self.ends)
+        ]
+
+
+class DiffParser:
+    """Parser of unified diffs into ParsedDiff records"""
+
+    # Format: @@ -old_start,old_count +new_start,new_count @@
+    hunk_header_re = re.compile(r'@@ -(\d+),?\d* \+(\d+),?\d* @@')
+
+    def iter_lines(self, diff_content):
+        """Yield (type, line_number, start, end) for each commentable line as it is scanned"""
+        find = diff_content.find
+        startswith = diff_content.startswith
+        match_hunk_header = self.hunk_header_re.match
+        length = len(diff_content)
+        current_new_line = 0
+        current_old_line = 0
+        pos = 0
+        # Walk the lines by offset instead of splitting, so line contents are never copied
+        while pos < length:
+            end = find('\n', pos)
+            if end == -1:
+                end = length
+            char = diff_content[pos]
+            if char == '@':
+                if startswith('@@', pos):
+                    # Parse hunk header to get starting line numbers
+                    match = match_hunk_header(diff_content, pos)
+                    if match:
+                        current_old_line = int(match.group(1))
+                        current_new_line = int(match.group(2))
+            elif char == '+':
+                if not startswith('+++', pos):
+                    # This is a new line that can be commented on (content skips the + prefix)
+                    yield LINE_NEW, current_new_line, pos + 1, end
+                    current_new_line += 1
+            elif char == '-':
+                if not startswith('---', pos):
+                    # This is a deleted line that can be commented on (content skips the - prefix)
+                    yield LINE_OLD, current_old_line, pos + 1, end
+                    current_old_line += 1
+            elif char == ' ':
+                # Context line - both line numbers advance
+                current_new_line += 1
+                current_old_line += 1
+            pos = end + 1
+
+    def iter_hunks(self, diff_content):
+        """Yield (start, end, additions, deletions) for each hunk of a diff.
+
+        start and end are offsets into diff_content; any lines before the first
+        hunk header belong to the first hunk.
+        """
+        find = diff_content.find
+        startswith = diff_content.startswith
+        match_hunk_header = self.hunk_header_re.match
+        length = len(diff_content)
+        hunk_start = 0
+        additions = 0
+        deletions = 0
+        seen_header = False
+        pos = 0
+        while pos < length:
+            end = find('\n', pos)
+            if end == -1:
+                end = length
+            char = diff_content[pos]
+            if char == '@':
+                if startswith('@@', pos) and match_hunk_header(diff_content, pos):
+                    if seen_header:
+                        yield hunk_start, pos, additions, deletions
+                        hunk_start = pos
+                        additions = 0
+                        deletions = 0
+                    seen_header = True
+            elif char == '+':
+                if not startswith('+++', pos):
+                    additions += 1
+            elif char == '-':
+                if not startswith('---', pos):
+                    deletions += 1
+            pos = end + 1
+        if length:
+            yield hunk_start, length, additions, deletions
+
+    def parse(self, diff_content):
+        """Parse diff content into the commentable (added and removed) lines"""
+        parsed = ParsedDiff(diff_content)
+        add_type = parsed.types.append
+        add_number = parsed.line_numbers.append
+        add_start = parsed.starts.append
+        add_end = parsed.ends.append
+        for line_type, line_number, start, end in self.iter_lines(diff_content):
+            add_type(line_type)
+            add_number(line_number)
+            add_start(start)
+            add_end(end)
+        return parsed
+
+
+diff_parser = DiffParser()
+
+
+def parse_diff_for_line_numbers(diff_content):
+    """Parse diff content to extract valid line numbers for comments"""
+    return diff_parser.parse(diff_content).to_dicts()
+
+
+def parse_diff_batch(diffs):
+    """Parse diffs in a worker process, returning only the arrays of each ParsedDiff"""
+    return [diff_parser.parse(diff).arrays() for diff in diffs]
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """Return the shared process pool for diff parsing, starting it on first use"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn rather than fork, since forking copies the locks of running threads
+            _parse_pool = ProcessPoolExecutor(max_workers=GITLAB_PARSE_PROCESSES,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def reset_parse_pool():
+    """Drop a broken parse pool so the next large merge request starts a new one"""
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def iter_parsed_changes(changes):
+    """Yield (change, ParsedDiff) for each change, in the order of changes.
+
+    Diffs are parsed inline unless their total size reaches
+    GITLAB_PARSE_PARALLEL_MIN_BYTES, in which case they are handed to the
+    process pool in batches. Small merge requests never start the pool, and
+    only the diffs seen before the threshold is reached are held back.
+    """
+    changes = iter(changes)
+    buffered = []
+    buffered_bytes = 0
+    if GITLAB_PARSE_PROCESSES > 1:
+        for change in changes:
+            buffered.append(change)
+            buffered_bytes += len(change.get("diff") or "")
+            if buffered_bytes >= GITLAB_PARSE_PARALLEL_MIN_BYTES:
+                yield from parse_changes_in_pool(buffered, changes)
+                return
+    for change in buffered or changes:
+        check_cancelled()
+        diff = change.get("diff") or ""
+        report_progress("parse", files=1, nbytes=len(diff))
+        yield change, diff_parser.parse(diff)
+
+
+def parse_changes_in_pool(buffered, changes):
+    """Parse changes in the process pool, keeping a bounded window of batches in flight"""
+    # Batches of about a megabyte keep the per-task overhead small next to the parsing work
+    batch_bytes = 1024 * 1024
+    window = deque()
+    pool = get_parse_pool()
+
+    def collect():
+        batch, diffs, future = window.popleft()
+        results = None
+        if future is not None:
+            try:
+                results = future.result()
+            except Exception:
+                # A crashed worker should not fail the request; the rest is parsed inline
+                reset_parse_pool()
+        if results is None:
+            results = parse_diff_batch(diffs)
+        report_progress("parse", files=len(diffs), nbytes=sum(len(diff) for diff in diffs))
+        for change, diff, arrays in zip(batch, diffs, results):
+            yield change, ParsedDiff.from_arrays(diff, arrays)
+
+    batch = []
+    size = 0
+    try:
+        for change in itertools.chain(buffered, changes, [None]):
+            if change is not None:
+                batch.append(change)
+                size += len(change.get("diff") or "")
+                if size < batch_bytes:
+                    continue
+            if batch:
+                check_cancelled()
+                diffs = [c.get("diff") or "" for c in batch]
+                future = None
+                if pool is not None:
+                    try:
+                        future = pool.submit(parse_diff_batch, diffs)
+                    except Exception:
+                        reset_parse_pool()
+                        pool = None
+                window.append((batch, diffs, future))
+                batch = []
+                size = 0
+            if len(window) > 2 * GITLAB_PARSE_PROCESSES:
+                yield from collect()
+        while window:
+            check_cancelled()
+            yield from collect()
+    finally:
+        # Batches still queued when the caller stops early or is cancelled are dropped
+        for _, _, future in window:
+            if future is not None:
+                future.cancel()
+
+
+def get_mr_commentable_lines(mr_iid_arg, file_filter=None):
+    """Get a list of lines that can be commented on in a merge request"""
+    commentable_lines_result = []
+    changes = iter_mr_changes(mr_iid_arg)
+    if file_filter is not None:
+        changes = file_filter.apply(changes)
+    for change, parsed in iter_parsed_changes(changes):
+        file_path_inner = change["new_path"]
+        valid_lines = parsed.to_dicts()
+        file_result = {
+            "file": file_path_inner,
+            "commentable_lines": valid_lines
+        }
+        if "omitted_diff_bytes" in change:
+            file_result["omitted_diff_bytes"] = change["omitted_diff_bytes"]
+        commentable_lines_result.append(file_result)
+
+    return commentable_lines_result
+
+
+def line_ranges(line_numbers):
+    """Run-length encode ascending line numbers as [start, count] pairs"""
+    ranges = []
+    line_numbers = iter(line_numbers)
+    # The outer loop only takes the first line; the inner one consumes the rest
+    for start in line_numbers:
+        previous = start
+        for line_number in line_numbers:
+            if line_number != previous + 1:
+                ranges.append([start, previous - start + 1])
+                start = line_number
+            previous = line_number
+        ranges.append([start, previous - start + 1])
+    return ranges
+
+
+def columnar_commentable_lines(change, parsed):
+    """Shape the commentable lines of one file as parallel arrays plus line ranges.
+
+    types holds LINE_OLD/LINE_NEW codes, and ranges lists the consecutive runs
+    of line numbers of each type.
+    """
+    diff = parsed.diff
+    types = parsed.types.tolist()
+    line_numbers = parsed.line_numbers.tolist()
+    file_result = {
+        "file": change["new_path"],
+        "types": types,
+        "line_numbers": line_numbers,
+        "contents": [diff[start:end] for start, end in zip(parsed.starts, parsed.ends)],
+        "ranges": {
+            # LINE_NEW is 1 and LINE_OLD is 0, so the type codes select the new lines as they are
+            "old": line_ranges(itertools.compress(line_numbers, map(operator.not_, types))),
+            "new": line_ranges(itertools.compress(line_numbers, types))
+        }
+    }
+    if "omitted_diff_bytes" in change:
+        file_result["omitted_diff_bytes"] = change["omitted_diff_bytes"]
+    return file_result
+
+
+def get_mr_commentable_lines_columnar(mr_iid_arg, file_filter=None):
+    """Get the commentable lines of a merge request in the columnar format"""
+    changes = iter_mr_changes(mr_iid_arg)
+    if file_filter is not None:
+        changes = file_filter.apply(changes)
+    return {
+        "line_types": list(LINE_TYPE_NAMES),
+        "files": [columnar_commentable_lines(change, parsed) for change, parsed in iter_parsed_changes(changes)]
+    }
+
+
+# Pieces of the commentable lines JSON text, as (pretty, compact) pairs
+_LINE_TEMPLATES = (
+    '\n      {\n        "type": "%s",\n        "line_number": %d,\n        "content": %s\n      }',
+    '{"type":"%s","line_number":%d,"content":%s}'
+)
+_FILE_OPENERS = (('[\n  {', ',\n  {'), ('[{', ',{'))
+_FILE_KEYS = (('\n    "file": ', ',\n    "commentable_lines": '), ('"file":', ',"commentable_lines":'))
+_LINES_CLOSERS = ('\n    ]', ']')
+_OMITTED_TEMPLATES = (',\n    "omitted_diff_bytes": %d', ',"omitted_diff_bytes":%d')
+_FILE_CLOSERS = ('\n  }', '}')
+_LIST_CLOSERS = ('\n]', ']')
+
+
+def iter_mr_commentable_lines_json(mr_iid_arg, file_filter=None, pretty=True):
+    """Yield get_mr_commentable_lines as JSON text, one chunk per file.
+
+    The chunks join to exactly json.dumps(get_mr_commentable_lines(...), indent=2),
+    or to its compact form when pretty is false, but lines are serialized
+    straight from the diff scan, so the nested per-line dicts are never built.
+    """
+    encode = json.encoder.encode_basestring_ascii
+    style = 0 if pretty else 1
+    line_template = _LINE_TEMPLATES[style]
+    first_opener, opener = _FILE_OPENERS[style]
+    file_key, lines_key = _FILE_KEYS[style]
+    changes = iter_mr_changes(mr_iid_arg)
+    if file_filter is not None:
+        changes = file_filter.apply(changes)
+    separator = first_opener
+    for change, parsed in iter_parsed_changes(changes):
+        diff = parsed.diff
+        lines = [
+            line_template % (LINE_TYPE_NAMES[line_type], line_number, encode(diff[start:end]))
+            for line_type, line_number, start, end in zip(*parsed.arrays())
+        ]
+        chunk = [separator, file_key, encode(change["new_path"]), lines_key]
+        if lines:
+            chunk.extend(("[", ",".join(lines), _LINES_CLOSERS[style]))
+        else:
+            chunk.append("[]")
+        if "omitted_diff_bytes" in change:
+            chunk.append(_OMITTED_TEMPLATES[style] % change["omitted_diff_bytes"])
+        chunk.append(_FILE_CLOSERS[style])
+        chunk = "".join(chunk)
+        report_progress("serialize", files=1, nbytes=len(chunk))
+        yield chunk
+        separator = opener
+    yield "[]" if separator == first_opener else _LIST_CLOSERS[style]
+
+
+class PositionIndex:
+    """Commentable line numbers of a merge request, per file and line type.
+
+    Each file maps to a pair of sorted arrays indexed by LINE_OLD and LINE_NEW,
+    so a position is checked with a binary search and the nearest valid lines
+    are its neighbours. Files whose diff is collapsed or too large map to None
+    since they cannot be checked locally.
+    """
 
+    def __init__(self):
+        self.files = {}
+        self.nbytes = 0
 
-def fetch_mr_details(mr_iid_arg):
-    """Fetch merge request details including diff_refs needed for inline comments"""
-    encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
-    url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}"
-    resp = requests.get(url, headers={"PRIVATE-TOKEN": GITLAB_TOKEN})
-    resp.raise_for_status()
-    return resp.json()
+    @classmethod
+    def from_changes(cls, changes):
+        index = cls()
+        for change, parsed in iter_parsed_changes(changes):
+            index.add(change["new_path"], parsed)
+        return index
 
+    def add(self, file_path, parsed):
+        """Index the lines of a ParsedDiff; an empty diff marks the file as not checkable"""
+        self.nbytes += len(file_path) + 64
+        if not parsed.diff:
+            self.files[file_path] = None
+            return
+        lines = (array("q"), array("q"))
+        for line_type, line_number in zip(parsed.types, parsed.line_numbers):
+            lines[line_type].append(line_number)
+        for line_numbers in lines:
+            # Hunks come in file order, so this only sorts unusual diffs
+            if any(line_numbers[i] >= line_numbers[i + 1] for i in range(len(line_numbers) - 1)):
+                line_numbers[:] = array("q", sorted(set(line_numbers)))
+            self.nbytes += line_numbers.itemsize * len(line_numbers)
+        self.files[file_path] = lines
 
-def parse_diff_for_line_numbers(diff_content):
-    """Parse diff content to extract valid line numbers for comments"""
-    lines = diff_content.split('\n')
-    valid_lines = []
-    current_new_line = 0
-    current_old_line = 0
-    for diff_line in lines:
-        if diff_line.startswith('@@'):
-            # Parse hunk header to get starting line numbers
-            # Format: @@ -old_start,old_count +new_start,new_count @@
-            import re
-            match = re.match(r'@@ -(\d+),?\d* \+(\d+),?\d* @@', diff_line)
-            if match:
-                current_old_line = int(match.group(1))
-                current_new_line = int(match.group(2))
-            continue
-        if diff_line.startswith('+') and not diff_line.startswith('+++'):
-            # This is a new line that can be commented on
-            valid_lines.append({
-                'type': 'new',
-                'line_number': current_new_line,
-                'content': diff_line[1:]  # Remove the + prefix
-            })
-            current_new_line += 1
-        elif diff_line.startswith('-') and not diff_line.startswith('---'):
-            # This is a deleted line that can be commented on
-            valid_lines.append({
-                'type': 'old',
-                'line_number': current_old_line,
-                'content': diff_line[1:]  # Remove the - prefix
-            })
-            current_old_line += 1
-        elif diff_line.startswith(' '):
-            # Context line - both line numbers advance
-            current_new_line += 1
-            current_old_line += 1
-    return valid_lines
+    def nearest(self, file_path, line_number, line_type, limit=2):
+        """Return up to limit commentable lines of line_type closest to line_number"""
+        lines = self.files.get(file_path)
+        if not lines:
+            return []
+        line_numbers = lines[LINE_TYPE_NAMES.index(line_type)]
+        pos = bisect.bisect_left(line_numbers, line_number)
+        before = pos - 1
+        after = pos
+        nearest = []
+        while len(nearest) < limit and (before >= 0 or after < len(line_numbers)):
+            if after >= len(line_numbers) or (
+                    before >= 0 and line_number - line_numbers[before] <= line_numbers[after] - line_number):
+                nearest.append(line_numbers[before])
+                before -= 1
+            else:
+                nearest.append(line_numbers[after])
+                after += 1
+        return nearest
 
+    def contains(self, file_path, line_number, line_type):
+        line_numbers = self.files[file_path][LINE_TYPE_NAMES.index(line_type)]
+        pos = bisect.bisect_left(line_numbers, line_number)
+        return pos < len(line_numbers) and line_numbers[pos] == line_number
 
-def get_mr_commentable_lines(mr_iid_arg):
-    """Get a list of lines that can be commented on in a merge request"""
-    encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
-    url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}/changes"
-    resp = requests.get(url, headers={"PRIVATE-TOKEN": GITLAB_TOKEN})
-    resp.raise_for_status()
-    data = resp.json()
-    commentable_lines_result = []
-    for change in data.get("changes", []):
-        file_path_inner = change["new_path"]
-        diff_content = change["diff"]
-        valid_lines = parse_diff_for_line_numbers(diff_content)
-        commentable_lines_result.append({
-            "file": file_path_inner,
-            "commentable_lines": valid_lines
-        })
+    def check(self, file_path, line_number, line_type="new"):
+        """Check whether an inline comment can be placed at (file_path, line_number, line_type).
 
-    return commentable_lines_result
+        Returns a dict with valid and checked flags; an invalid position also
+        carries an error and the nearest commentable positions as suggestions.
+        """
+        result = {
+            "file_path": file_path,
+            "line_number": line_number,
+            "line_type": line_type,
+            "valid": False,
+            "checked": True
+        }
+        if line_type not in LINE_TYPE_NAMES:
+            result.update(error=f"Unknown line_type: {line_type}", suggestions=[])
+        elif file_path not in self.files:
+            result.update(error=f"File {file_path} is not part of the merge request diff", suggestions=[])
+        elif self.files[file_path] is None:
+            # Collapsed diffs are left for GitLab to judge
+            result.update(valid=True, checked=False)
+        elif not isinstance(line_number, int) or not self.contains(file_path, line_number, line_type):
+            result["error"] = f"Line {line_number} is not a {line_type} line in the diff of {file_path}"
+            suggestions = []
+            if isinstance(line_number, int):
+                other_type = LINE_TYPE_NAMES[1 - LINE_TYPE_NAMES.index(line_type)]
+                if self.contains(file_path, line_number, other_type):
+                    suggestions.append({"line_number": line_number, "line_type": other_type})
+                suggestions.extend({"line_number": n, "line_type": line_type}
+                                   for n in self.nearest(file_path, line_number, line_type))
+            result["suggestions"] = suggestions
+        else:
+            result["valid"] = True
+        return result
 
 
-def add_mr_inline_comment(mr_iid_arg, file_path_arg, line_number_arg, comment_body_arg, line_type_arg="new"):
-    """Add an inline comment to a merge request"""
-    encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
-    # First, get the merge request details to extract diff_refs
-    mr_details = fetch_mr_details(mr_iid_arg)
-    diff_refs = mr_details.get('diff_refs')
-    if not diff_refs:
-        raise ValueError("Could not get diff_refs from merge request")
-    # Create the position object for the inline comment
+def position_error_message(check):
+    """Describe a failed PositionIndex.check, including its suggestions"""
+    message = check["error"]
+    if check.get("suggestions"):
+        message += "; nearest commentable positions: " + ", ".join(
+            f"{s['line_type']} line {s['line_number']}" for s in check["suggestions"])
+    return message
+
+
+def get_mr_position_index(mr_iid_arg, project_path_arg=None, head_sha_arg=None):
+    """Return the PositionIndex of a merge request, kept with its cached changes"""
+    project_path = project_path_arg or GITLAB_PROJECT_PATH
+    head_sha = head_sha_arg or resolve_head_sha(mr_iid_arg, project_path)
+    key = (project_path, str(mr_iid_arg), head_sha)
+    index = mr_changes_cache.get_derived(key, "positions")
+    if index is None:
+        index = PositionIndex.from_changes(iter_mr_changes(mr_iid_arg, project_path, head_sha))
+        mr_changes_cache.put_derived(key, "positions", index, index.nbytes)
+    return index
+
+
+def build_inline_position(diff_refs, file_path_arg, line_number_arg, line_type_arg="new"):
+    """Build the GitLab position object for an inline comment"""
     position = {
         'base_sha': diff_refs['base_sha'],
         'start_sha': diff_refs['start_sha'],
@@ -110,17 +2052,92 @@ def add_mr_inline_comment(mr_iid_arg, file_path_arg, line_number_arg, comment_bo
     else:
         position['old_line'] = line_number_arg
         position['old_path'] = file_path_arg
-    # Create the discussion
+    return position
+
+
+def post_mr_discussion(mr_iid_arg, comment_body_arg, position):
+    """Create a diff discussion on a merge request at the given position"""
+    encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
     url = f"{GITLAB_URL}/api/v4/projects/{encoded_path}/merge_requests/{mr_iid_arg}/discussions"
     data = {
         'body': comment_body_arg,
         'position': position
     }
-    resp = requests.post(url, headers={"PRIVATE-TOKEN": GITLAB_TOKEN}, json=data)
+    resp = gitlab_request("POST", url, json=data)
     resp.raise_for_status()
     return resp.json()
 
 
+def add_mr_inline_comment(mr_iid_arg, file_path_arg, line_number_arg, comment_body_arg, line_type_arg="new"):
+    """Add an inline comment to a merge request"""
+    # First, get the merge request details to extract diff_refs
+    mr_details = fetch_mr_details(mr_iid_arg)
+    diff_refs = mr_details.get('diff_refs')
+    if not diff_refs:
+        raise ValueError("Could not get diff_refs from merge request")
+    # Reject positions outside the diff here rather than after a round trip to GitLab
+    check = get_mr_position_index(mr_iid_arg, head_sha_arg=diff_refs.get('head_sha')).check(
+        file_path_arg, line_number_arg, line_type_arg)
+    if not check["valid"]:
+        raise ValueError(position_error_message(check))
+    position = build_inline_position(diff_refs, file_path_arg, line_number_arg, line_type_arg)
+    return post_mr_discussion(mr_iid_arg, comment_body_arg, position)
+
+
+def add_mr_inline_comments_batch(mr_iid_arg, comments, max_concurrency=None):
+    """Validate and post many inline comments, resolving diff_refs and the diff only once.
+
+    Each comment is a dict with file_path, line_number, comment_body and an
+    optional line_type. Comments whose position is not a changed line of the
+    diff are reported as invalid without a round trip; the rest are posted
+    with at most max_concurrency requests in flight. Returns one result per
+    comment, in input order.
+    """
+    mr_details = fetch_mr_details(mr_iid_arg)
+    diff_refs = mr_details.get('diff_refs')
+    if not diff_refs:
+        raise ValueError("Could not get diff_refs from merge request")
+    position_index = get_mr_position_index(mr_iid_arg, head_sha_arg=diff_refs.get('head_sha'))
+
+    results = []
+    pending = []
+    for index, comment in enumerate(comments):
+        file_path = comment.get("file_path")
+        line_number = comment.get("line_number")
+        line_type = comment.get("line_type", "new")
+        result = {
+            "index": index,
+            "file_path": file_path,
+            "line_number": line_number,
+            "line_type": line_type
+        }
+        results.append(result)
+        if not all([file_path, line_number, comment.get("comment_body")]):
+            result.update(status="invalid", error="Missing required fields: file_path, line_number and comment_body")
+            continue
+        check = position_index.check(file_path, line_number, line_type)
+        if not check["valid"]:
+            result.update(status="invalid", error=check["error"], suggestions=check["suggestions"])
+        else:
+            position = build_inline_position(diff_refs, file_path, line_number, line_type)
+            pending.append((result, comment["comment_body"], position))
+
+    if pending:
+        workers = min(max_concurrency or GITLAB_COMMENT_CONCURRENCY, len(pending))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mcp-comment") as pool:
+            futures = {
+                pool.submit(run_in_call, current_call(), post_mr_discussion, mr_iid_arg, body, position): result
+                for result, body, position in pending
+            }
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    result.update(status="posted", discussion_id=future.result().get("id"))
+                except Exception as e:
+                    result.update(status="failed", error=str(e))
+    return results
+
+
 def add_mr_general_comment(mr_iid_arg, comment_body_arg):
     """Add a general comment to a merge request"""
     encoded_path = urllib.parse.quote_plus(GITLAB_PROJECT_PATH)
@@ -128,271 +2145,1162 @@ def add_mr_general_comment(mr_iid_arg, comment_body_arg):
     data = {
         'body': comment_body_arg
     }
-    resp = requests.post(url, headers={"PRIVATE-TOKEN": GITLAB_TOKEN}, json=data)
+    resp = gitlab_request("POST", url, json=data)
     resp.raise_for_status()
     return resp.json()
 
 
+TOOLS = [
+    {
+        "name": "hello_world",
+        "description": "Returns a friendly hello message",
+        "inputSchema": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    },
+    {
+        "name": "fetch_merge_request_diff",
+        "description": "Fetches the diff of a given merge request for a GitLab project",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string"},
+                "mr_iid": {"type": "integer"},
+                "cursor": {
+                    "type": "string",
+                    "description": "next_cursor returned by the previous page"
+                },
+                "page_size": {
+                    "type": "integer",
+                    "description": "Maximum number of files per page; enables paginated output"
+                },
+                "max_page_bytes": {
+                    "type": "integer",
+                    "description": "Maximum diff bytes per page (a page always holds at least one file); enables paginated output"
+                },
+                "include": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Only return files matching one of these globs, e.g. src/**"
+                },
+                "exclude": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Skip files matching one of these globs, e.g. *.lock or vendor/**"
+                },
+                "max_diff_bytes_per_file": {
+                    "type": "integer",
+                    "description": "Omit the diff of files larger than this; they are listed with omitted_diff_bytes"
+                },
+                "max_output_bytes": {
+                    "type": "integer",
+                    "description": (
+                        "Approximate size limit of the output (about 4 bytes per token). Over the limit, whole "
+                        "hunks of the most relevant files are kept and the rest is summarized with stats"
+                    )
+                }
+            },
+            "required": ["project_path", "mr_iid"]
+        }
+    },
+    {
+        "name": "fetch_merge_request_diffs",
+        "description": (
+            "Fetches the diffs of several merge requests in parallel. Each merge request gets "
+            "its own result or error, listed in input order"
+        ),
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "merge_requests": {
+                    "type": "array",
+                    "description": "Merge requests to fetch",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "project_path": {"type": "string", "description": "GitLab project path"},
+                            "mr_iid": {"type": "integer", "description": "Merge request IID"}
+                        },
+                        "required": ["project_path", "mr_iid"]
+                    }
+                },
+                "max_concurrency": {
+                    "type": "integer",
+                    "description": "Maximum number of merge requests fetched at the same time"
+                }
+            },
+            "required": ["merge_requests"]
+        }
+    },
+    {
+        "name": "add_merge_request_inline_comment",
+        "description": "Adds an inline comment to a specific line in a merge request diff",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "file_path": {"type": "string", "description": "Path to the file in the diff"},
+                "line_number": {"type": "integer", "description": "Line number to comment on"},
+                "comment_body": {"type": "string", "description": "The comment text"},
+                # line_type: new or old
+                "line_type": {
+                    "type": "string",
+                    "enum": ["new", "old"],
+                    "default": "new",
+                    "description": "Whether to comment on new line (added) or old line (removed)"
+                }
+            },
+            "required": ["project_path", "mr_iid", "file_path", "line_number", "comment_body"]
+        }
+    },
+    {
+        "name": "add_merge_request_inline_comments_batch",
+        "description": (
+            "Adds many inline comments to a merge request in one call. Positions are validated "
+            "against the diff first and valid comments are posted in parallel"
+        ),
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "comments": {
+                    "type": "array",
+                    "description": "Inline comments to add",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "file_path": {"type": "string", "description": "Path to the file in the diff"},
+                            "line_number": {"type": "integer", "description": "Line number to comment on"},
+                            "comment_body": {"type": "string", "description": "The comment text"},
+                            "line_type": {
+                                "type": "string",
+                                "enum": ["new", "old"],
+                                "default": "new",
+                                "description": "Whether to comment on new line (added) or old line (removed)"
+                            }
+                        },
+                        "required": ["file_path", "line_number", "comment_body"]
+                    }
+                },
+                "max_concurrency": {
+                    "type": "integer",
+                    "description": "Maximum number of comments posted at the same time"
+                }
+            },
+            "required": ["project_path", "mr_iid", "comments"]
+        }
+    },
+    {
+        "name": "check_commentable_position",
+        "description": (
+            "Checks whether an inline comment can be placed on a line of a merge request diff, "
+            "suggesting the nearest commentable lines when it cannot"
+        ),
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "file_path": {"type": "string", "description": "Path to the file in the diff"},
+                "line_number": {"type": "integer", "description": "Line number to check"},
+                "line_type": {
+                    "type": "string",
+                    "enum": ["new", "old"],
+                    "default": "new",
+                    "description": "Whether to check a new line (added) or old line (removed)"
+                }
+            },
+            "required": ["project_path", "mr_iid", "file_path", "line_number"]
+        }
+    },
+    {
+        "name": "get_merge_request_diff_stats",
+        "description": (
+            "Lists the files changed by a merge request with their additions, deletions, hunk count "
+            "and new/renamed/deleted/binary/too_large flags, without the diff bodies"
+        ),
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "include": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Only return files matching one of these globs, e.g. src/**"
+                },
+                "exclude": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Skip files matching one of these globs, e.g. *.lock or vendor/**"
+                }
+            },
+            "required": ["project_path", "mr_iid"]
+        }
+    },
+    {
+        "name": "get_merge_request_commentable_lines",
+        "description": "Gets a list of lines that can be commented on in a merge request diff",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "include": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Only return files matching one of these globs, e.g. src/**"
+                },
+                "exclude": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Skip files matching one of these globs, e.g. *.lock or vendor/**"
+                },
+                "max_diff_bytes_per_file": {
+                    "type": "integer",
+                    "description": "Omit the diff of files larger than this; they are listed with omitted_diff_bytes"
+                },
+                "format": {
+                    "type": "string",
+                    "enum": ["lines", "columnar"],
+                    "default": "lines",
+                    "description": (
+                        "lines: one object per line. columnar: compact per-file arrays of types, line numbers "
+                        "and contents plus consecutive line ranges"
+                    )
+                }
+            },
+            "required": ["project_path", "mr_iid"]
+        }
+    },
+    {
+        "name": "add_merge_request_general_comment",
+        "description": "Adds a general comment to a merge request (appears in Overview tab)",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "project_path": {"type": "string", "description": "GitLab project path"},
+                "mr_iid": {"type": "integer", "description": "Merge request IID"},
+                "comment_body": {"type": "string", "description": "The comment text"}
+            },
+            "required": ["project_path", "mr_iid", "comment_body"]
+        }
+    },
+    {
+        "name": "get_server_stats",
+        "description": "Returns server statistics such as merge request cache hits and misses",
+        "inputSchema": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    }
+]
+
+
+def tool_hello_world(params):
+    return "Hello from your Private GitLab MCP!"
+
+
+def tool_fetch_merge_request_diff(params):
+    mr_iid = params["mr_iid"]
+    file_filter = FileFilter.from_params(params)
+    paginated = any(params.get(name) for name in ("cursor", "page_size", "max_page_bytes"))
+    if params.get("max_output_bytes"):
+        if paginated:
+            raise ValueError("max_output_bytes cannot be combined with cursor, page_size or max_page_bytes")
+        result = fetch_mr_diff_budgeted(mr_iid, params["max_output_bytes"], file_filter=file_filter)
+    elif paginated:
+        result = fetch_mr_diff_page(mr_iid, params.get("cursor"), params.get("page_size"),
+                                    params.get("max_page_bytes"), file_filter=file_filter)
+    else:
+        result = fetch_mr_diff(mr_iid, file_filter=file_filter)
+    return format_result(result)
+
+
+def tool_fetch_merge_request_diffs(params):
+    merge_requests = params.get("merge_requests")
+    if not merge_requests:
+        raise ValueError("Missing required parameter: merge_requests")
+    if not all(isinstance(mr, dict) and mr.get("mr_iid") for mr in merge_requests):
+        raise ValueError("Every merge request needs an mr_iid")
+    result = fetch_mr_diffs(merge_requests, params.get("max_concurrency"))
+    return format_result(result)
+
+
+def tool_add_merge_request_inline_comment(params):
+    mr_iid = params.get("mr_iid")
+    file_path = params.get("file_path")
+    line_number = params.get("line_number")
+    comment_body = params.get("comment_body")
+    line_type = params.get("line_type", "new")
+    if not all([mr_iid, file_path, line_number, comment_body]):
+        raise ValueError("Missing required parameters")
+    result = add_mr_inline_comment(mr_iid, file_path, line_number, comment_body, line_type)
+    return (
+        f"Successfully added inline comment to {file_path} at line {line_number}. "
+        f"Discussion ID: {result.get('id')}"
+    )
+
+
+def tool_add_merge_request_inline_comments_batch(params):
+    mr_iid = params.get("mr_iid")
+    comments = params.get("comments")
+    if not all([mr_iid, comments]):
+        raise ValueError("Missing required parameters: mr_iid and comments")
+    results = add_mr_inline_comments_batch(mr_iid, comments, params.get("max_concurrency"))
+    summary = {"posted": 0, "failed": 0, "invalid": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    summary["results"] = results
+    return format_result(summary)
+
+
+def tool_check_commentable_position(params):
+    mr_iid = params.get("mr_iid")
+    file_path = params.get("file_path")
+    line_number = params.get("line_number")
+    if not all([mr_iid, file_path, line_number]):
+        raise ValueError("Missing required parameters: mr_iid, file_path and line_number")
+    result = get_mr_position_index(mr_iid).check(file_path, line_number, params.get("line_type", "new"))
+    return format_result(result)
+
+
+def tool_get_merge_request_diff_stats(params):
+    mr_iid = params.get("mr_iid")
+    if not mr_iid:
+        raise ValueError("Missing required parameter: mr_iid")
+    result = fetch_mr_diff_stats(mr_iid, file_filter=FileFilter.from_params(params))
+    return format_result(result)
+
+
+def tool_get_merge_request_commentable_lines(params):
+    mr_iid = params.get("mr_iid")
+    if not mr_iid:
+        raise ValueError("Missing required parameter: mr_iid")
+    output_format = params.get("format", "lines")
+    if output_format == "columnar":
+        result = get_mr_commentable_lines_columnar(mr_iid, FileFilter.from_params(params))
+        # Columnar output is meant to be small, so it is never pretty-printed
+        return json_codec.encode(result).decode("utf-8")
+    if output_format != "lines":
+        raise ValueError(f"Unknown format: {output_format}")
+    return "".join(iter_mr_commentable_lines_json(mr_iid, FileFilter.from_params(params), pretty=MCP_PRETTY_JSON))
+
+
+def tool_add_merge_request_general_comment(params):
+    mr_iid = params.get("mr_iid")
+    comment_body = params.get("comment_body")
+    if not all([mr_iid, comment_body]):
+        raise ValueError("Missing required parameters: mr_iid and comment_body")
+    result = add_mr_general_comment(mr_iid, comment_body)
+    return (
+        f"Successfully added general comment to merge request {mr_iid}. "
+        f"Note ID: {result.get('id')}"
+    )
+
+
+def tool_get_server_stats(params):
+    return format_result({
+        "mr_changes_cache": mr_changes_cache.stats(),
+        "conditional_get": revalidation_store.stats(),
+        "outbound_scheduler": outbound_scheduler.stats(),
+        "read_coalescing": read_flights.stats(),
+        "json_codec": json_codec.name
+    })
+
+
+# Maps tool names to handlers that take the call arguments and return the result text
+TOOL_HANDLERS = {
+    "hello_world": tool_hello_world,
+    "fetch_merge_request_diff": tool_fetch_merge_request_diff,
+    "fetch_merge_request_diffs": tool_fetch_merge_request_diffs,
+    "add_merge_request_inline_comment": tool_add_merge_request_inline_comment,
+    "add_merge_request_inline_comments_batch": tool_add_merge_request_inline_comments_batch,
+    "check_commentable_position": tool_check_commentable_position,
+    "get_merge_request_diff_stats": tool_get_merge_request_diff_stats,
+    "get_merge_request_commentable_lines": tool_get_merge_request_commentable_lines,
+    "add_merge_request_general_comment": tool_add_merge_request_general_comment,
+    "get_server_stats": tool_get_server_stats,
+}
+
+
+def stdlib_json_encode(obj):
+    # ASCII output is faster to produce with the C encoder than UTF-8, and is valid UTF-8 too
+    return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+class JsonCodec:
+    """Compact JSON encoding and decoding with orjson or msgspec when installed.
+
+    name picks the library: "auto" tries orjson, then msgspec, then the
+    standard library, which is also used when a requested library is missing.
+    encode returns UTF-8 bytes; values a fast library rejects, such as
+    integers beyond 64 bits, are encoded with the standard library instead.
+    decode raises ValueError on malformed input whatever the library.
+    """
+
+    def __init__(self, name="auto"):
+        self.name = "json"
+        self._encode = stdlib_json_encode
+        self._decode = json.loads
+        self._decode_errors = ()
+        if name in ("auto", "orjson"):
+            try:
+                import orjson
+                self.name, self._encode, self._decode = "orjson", orjson.dumps, orjson.loads
+                return
+            except ImportError:
+                pass
+        if name in ("auto", "msgspec"):
+            try:
+                import msgspec
+                self.name, self._encode, self._decode = "msgspec", msgspec.json.encode, msgspec.json.decode
+                self._decode_errors = (msgspec.DecodeError,)
+            except ImportError:
+                pass
+
+    def encode(self, obj):
+        try:
+            return self._encode(obj)
+        except Exception:
+            # ASCII escapes also cover strings that are not valid UTF-8, such as lone surrogates
+            return stdlib_json_encode(obj)
+
+    def decode(self, data):
+        try:
+            return self._decode(data)
+        except self._decode_errors as e:
+            raise ValueError(str(e))
+
+
+json_codec = JsonCodec(MCP_JSON_CODEC)
+
+
+def format_result(result):
+    """Encode a tool result as its response text, compactly unless MCP_PRETTY_JSON is set"""
+    if MCP_PRETTY_JSON:
+        return json.dumps(result, indent=2)
+    return json_codec.encode(result).decode("utf-8")
+
+
+_stdout_lock = threading.Lock()
+
+
 def respond(obj):
     """Send a JSON response over stdout"""
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
+    line = json_codec.encode(obj) + b"\n"
+    # Tool calls finish on worker threads, so whole lines are written under a lock
+    with _stdout_lock:
+        stdout = getattr(sys.stdout, "buffer", None)
+        if stdout is None:
+            sys.stdout.write(line.decode("utf-8"))
+            sys.stdout.flush()
+        else:
+            stdout.write(line)
+            stdout.flush()
 
 
-def main():
-    """Main entry point for the GitLab MCP server"""
+def error_response(msg, code, message):
+    """Build a JSON-RPC error response for msg"""
+    return {
+        "jsonrpc": "2.0",
+        "id": msg.get("id"),
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+
+def handle_tools_call(msg):
+    """Run a tools/call request and return its JSON-RPC response"""
+    call_params = msg.get("params", {})
+    if not isinstance(call_params, dict):
+        return error_response(msg, -32602, "Invalid params: expected an object with the tool name and arguments")
+    tool_name = call_params.get("name")
+    handler = TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        return error_response(msg, -32601, f"Unknown tool: {tool_name}")
+    try:
+        params = call_params.get("arguments", {})
+        text = handler(params)
+    except Exception as e:
+        return error_response(msg, -32603, f"{tool_name} failed: {e}")
+    return {
+        "jsonrpc": "2.0",
+        "id": msg.get("id"),
+        "result": {
+            "content": [
+                {
+                    "type": "text",
+                    "text": text
+                }
+            ]
+        }
+    }
+
+
+def handle_message(msg):
+    """Handle a single JSON-RPC message and return its response"""
+    msg_type = msg.get("method")
+
+    if msg_type == "initialize":
+        return {
+            "jsonrpc": "2.0",
+            "id": msg.get("id"),
+            "result": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {
+                    "tools": {}
+                },
+                "serverInfo": {
+                    "name": "Private GitLab MCP",
+                    "version": "0.1"
+                }
+            }
+        }
+
+    elif msg_type == "tools/list":
+        return {
+            "jsonrpc": "2.0",
+            "id": msg.get("id"),
+            "result": {
+                "tools": TOOLS
+            }
+        }
+
+    elif msg_type == "tools/call":
+        return handle_tools_call(msg)
+
+    return error_response(msg, -32601, f"Unknown message type: {msg_type}")
+
+
+def handle_notification(msg, calls):
+    """Act on a JSON-RPC notification. Notifications are never answered, not even with errors"""
+    params = msg.get("params")
+    if msg.get("method") == "notifications/cancelled" and isinstance(params, dict):
+        calls.cancel(params.get("requestId"))
+
+
+def call_tool(msg, context):
+    """Run a tools/call request on behalf of context.
+
+    Returns its JSON-RPC response, or None when the call was cancelled before
+    or while it ran; a cancelled call is not answered.
+    """
+    if context.cancelled.is_set():
+        return None
+    try:
+        response = run_in_call(context, handle_tools_call, msg)
+    except CallCancelled:
+        return None
+    finally:
+        context.end_progress()
+    return None if context.cancelled.is_set() else response
+
+
+def progress_token(msg):
+    """Return the progressToken a request asks progress notifications for, or None"""
+    params = msg.get("params")
+    meta = params.get("_meta") if isinstance(params, dict) else None
+    return meta.get("progressToken") if isinstance(meta, dict) else None
+
+
+def run_tool_call(msg, calls, context, send=None):
+    """Worker entry point: run a tools/call request and return its response.
+
+    The response is also written with send, unless the call was cancelled.
+    """
+    try:
+        response = call_tool(msg, context)
+    finally:
+        calls.finish(context)
+    if response is not None and send is not None:
+        send(response)
+    return response
+
+
+def submit_batch(batch, calls, executor, send=None, reply=False):
+    """Dispatch the messages of a non-empty JSON-RPC batch.
+
+    Tool calls run concurrently on executor and share GitLab fetches and cache
+    entries like any other calls; each is registered in calls, so it can be
+    cancelled on its own. send carries their progress notifications, and
+    with reply also the batch response.
+    Returns a Future of the list of responses, resolved once every call has
+    finished and the response is sent, or failed to send. It resolves to None
+    when there is nothing to answer, as for a batch of notifications. Cancelled
+    calls are left out, and a call that raised gets an internal error.
+    """
+    responses = []
+    futures = []
+    for msg in batch:
+        if not isinstance(msg, dict):
+            responses.append(error_response({}, -32600, "Invalid request"))
+        elif "id" not in msg:
+            handle_notification(msg, calls)
+        elif msg.get("method") == "tools/call":
+            context = calls.start(msg["id"], progress_token(msg), send)
+            futures.append((msg, executor.submit(run_tool_call, msg, calls, context)))
+        else:
+            responses.append(handle_message(msg))
+
+    result = Future()
+    lock = threading.Lock()
+    remaining = len(futures)
+
+    def resolve():
+        try:
+            if reply and responses:
+                send(responses)
+        except OSError:
+            pass  # The client went away; nobody is left to answer
+        finally:
+            result.set_result(responses or None)
+
+    def finished(msg, future):
+        nonlocal remaining
+        try:
+            response = future.result()
+        except Exception as e:
+            response = error_response(msg, -32603, f"Internal error: {e}")
+        with lock:
+            if response is not None:
+                responses.append(response)
+            remaining -= 1
+            if remaining:
+                return
+        resolve()
+
+    if not futures:
+        resolve()
+    for msg, future in futures:
+        future.add_done_callback(functools.partial(finished, msg))
+    return result
+
+
+def serve_lines(readline, send, executor):
+    """Answer line-delimited JSON-RPC messages until readline returns an empty line.
+
+    Tool calls run on executor and are answered by id in completion order, so
+    one slow GitLab fetch does not hold up the requests queued behind it. A
+    batch is answered with one array once all of its calls are done. A
+    notifications/cancelled message aborts the call it names.
+    Returns the tool calls and batches still running.
+    """
+    calls = CallRegistry()
+    pending = set()
+    pending_lock = threading.Lock()
+
+    def finished(future):
+        with pending_lock:
+            pending.discard(future)
+
     while True:
-        line = sys.stdin.readline()
+        line = readline()
         if not line:
-            break
+            with pending_lock:
+                return list(pending)
 
         try:
-            msg = json.loads(line)
-        except json.JSONDecodeError:
+            msg = json_codec.decode(line)
+        except ValueError:
             continue  # Ignore malformed messages
 
-        msg_type = msg.get("method")
-
-        if msg_type == "initialize":
-            respond({
-                "jsonrpc": "2.0",
-                "id": msg.get("id"),
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "tools": {}
-                    },
-                    "serverInfo": {
-                        "name": "Private GitLab MCP",
-                        "version": "0.1"
-                    }
-                }
-            })
+        if isinstance(msg, list) and msg:
+            future = submit_batch(msg, calls, executor, send, reply=True)
+            with pending_lock:
+                pending.add(future)
+            future.add_done_callback(finished)
+        elif not isinstance(msg, dict):
+            # Includes the empty batch, which is answered with a single error
+            send(error_response({}, -32600, "Invalid request"))
+        elif "id" not in msg:
+            handle_notification(msg, calls)
+        elif msg.get("method") == "tools/call":
+            # Registered before it is queued, so it can be cancelled while it waits for a worker
+            context = calls.start(msg["id"], progress_token(msg), send)
+            future = executor.submit(run_tool_call, msg, calls, context, send)
+            with pending_lock:
+                pending.add(future)
+            future.add_done_callback(finished)
+        else:
+            # initialize, tools/list and unknown methods are answered right away
+            send(handle_message(msg))
 
-        elif msg_type == "tools/list":
-            respond({
-                "jsonrpc": "2.0",
-                "id": msg.get("id"),
-                "result": {
-                    "tools": [
-                        {
-                            "name": "hello_world",
-                            "description": "Returns a friendly hello message",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {},
-                                "required": []
-                            }
-                        },
-                        {
-                            "name": "fetch_merge_request_diff",
-                            "description": "Fetches the diff of a given merge request for a GitLab project",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "project_path": {"type": "string"},
-                                    "mr_iid": {"type": "integer"}
-                                },
-                                "required": ["project_path", "mr_iid"]
-                            }
-                        },
-                        {
-                            "name": "add_merge_request_inline_comment",
-                            "description": "Adds an inline comment to a specific line in a merge request diff",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "project_path": {"type": "string", "description": "GitLab project path"},
-                                    "mr_iid": {"type": "integer", "description": "Merge request IID"},
-                                    "file_path": {"type": "string", "description": "Path to the file in the diff"},
-                                    "line_number": {"type": "integer", "description": "Line number to comment on"},
-                                    "comment_body": {"type": "string", "description": "The comment text"},
-                                    # line_type: new or old
-                                    "line_type": {
-                                        "type": "string",
-                                        "enum": ["new", "old"],
-                                        "default": "new",
-                                        "description": "Whether to comment on new line (added) or old line (removed)"
-                                    }
-                                },
-                                "required": ["project_path", "mr_iid", "file_path", "line_number", "comment_body"]
-                            }
-                        },
-                        {
-                            "name": "get_merge_request_commentable_lines",
-                            "description": "Gets a list of lines that can be commented on in a merge request diff",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "project_path": {"type": "string", "description": "GitLab project path"},
-                                    "mr_iid": {"type": "integer", "description": "Merge request IID"}
-                                },
-                                "required": ["project_path", "mr_iid"]
-                            }
-                        },
-                        {
-                            "name": "add_merge_request_general_comment",
-                            "description": "Adds a general comment to a merge request (appears in Overview tab)",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "project_path": {"type": "string", "description": "GitLab project path"},
-                                    "mr_iid": {"type": "integer", "description": "Merge request IID"},
-                                    "comment_body": {"type": "string", "description": "The comment text"}
-                                },
-                                "required": ["project_path", "mr_iid", "comment_body"]
-                            }
-                        }
-                    ]
-                }
-            })
 
-        elif msg_type == "tools/call":
-            if msg.get("params", {}).get("name") == "hello_world":
-                respond({
-                    "jsonrpc": "2.0",
-                    "id": msg.get("id"),
-                    "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Hello from your Private GitLab MCP!"
-                            }
-                        ]
-                    }
-                })
-            elif msg.get("params", {}).get("name") == "fetch_merge_request_diff":
-                try:
-                    params = msg.get("params", {}).get("arguments", {})
-                    mr_iid = params["mr_iid"]
-                    result = fetch_mr_diff(mr_iid)
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": json.dumps(result, indent=2)
-                                }
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "error": {
-                            "code": -32603,
-                            "message": f"fetch_merge_request_diff failed: {e}"
-                        }
-                    })
-            elif msg.get("params", {}).get("name") == "add_merge_request_inline_comment":
-                try:
-                    params = msg.get("params", {}).get("arguments", {})
-                    mr_iid = params.get("mr_iid")
-                    file_path = params.get("file_path")
-                    line_number = params.get("line_number")
-                    comment_body = params.get("comment_body")
-                    line_type = params.get("line_type", "new")
-                    if not all([mr_iid, file_path, line_number, comment_body]):
-                        raise ValueError("Missing required parameters")
-                    result = add_mr_inline_comment(mr_iid, file_path, line_number, comment_body, line_type)
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": (
-                                        f"Successfully added inline comment to {file_path} at line {line_number}. "
-                                        f"Discussion ID: {result.get('id')}"
-                                    )
-                                }
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "error": {
-                            "code": -32603,
-                            "message": f"add_merge_request_inline_comment failed: {e}"
-                        }
-                    })
-            elif msg.get("params", {}).get("name") == "get_merge_request_commentable_lines":
-                try:
-                    params = msg.get("params", {}).get("arguments", {})
-                    mr_iid = params.get("mr_iid")
-                    if not mr_iid:
-                        raise ValueError("Missing required parameter: mr_iid")
-                    result = get_mr_commentable_lines(mr_iid)
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": json.dumps(result, indent=2)
-                                }
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "error": {
-                            "code": -32603,
-                            "message": f"get_merge_request_commentable_lines failed: {e}"
-                        }
-                    })
-            elif msg.get("params", {}).get("name") == "add_merge_request_general_comment":
-                try:
-                    params = msg.get("params", {}).get("arguments", {})
-                    mr_iid = params.get("mr_iid")
-                    comment_body = params.get("comment_body")
-                    if not all([mr_iid, comment_body]):
-                        raise ValueError("Missing required parameters: mr_iid and comment_body")
-                    result = add_mr_general_comment(mr_iid, comment_body)
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": (
-                                        f"Successfully added general comment to merge request {mr_iid}. "
-                                        f"Note ID: {result.get('id')}"
-                                    )
-                                }
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    respond({
-                        "jsonrpc": "2.0",
-                        "id": msg.get("id"),
-                        "error": {
-                            "code": -32603,
-                            "message": f"add_merge_request_general_comment failed: {e}"
-                        }
-                    })
+class SSEStream:
+    """Writes JSON-RPC messages to an HTTP response as server-sent events.
+
+    The body uses chunked transfer encoding, so events reach the client as
+    they are sent and the connection can be kept alive afterwards. The calls of
+    a batch send from several workers at once, so each chunk is written whole
+    under a lock.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._lock = threading.Lock()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+    def send(self, obj):
+        self._write_chunk(b"event: message\ndata: " + json_codec.encode(obj) + b"\n\n")
+
+    def close(self):
+        with self._lock:
+            self.handler.wfile.write(b"0\r\n\r\n")
+            self.handler.wfile.flush()
+
+    def _write_chunk(self, data):
+        with self._lock:
+            self.handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.handler.wfile.flush()
+
+
+class HTTPSessions:
+    """CallRegistry of each HTTP client session, by the Mcp-Session-Id issued on initialize"""
+
+    def __init__(self, max_sessions=None):
+        self.max_sessions = MCP_HTTP_MAX_SESSIONS if max_sessions is None else max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = CallRegistry()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        """Calls of the session, or None when it is unknown or has ended"""
+        with self._lock:
+            calls = self._sessions.get(session_id)
+            if calls is not None:
+                self._sessions.move_to_end(session_id)
+            return calls
+
+    def end(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
 
+class MCPHTTPRequestHandler(BaseHTTPRequestHandler):
+    """Streamable HTTP transport: one JSON-RPC message or batch per POST to MCP_HTTP_PATH.
+
+    Requests are answered with a JSON body, or with an SSE stream when the
+    client accepts text/event-stream; notifications get 202 Accepted. Tool
+    calls run on the server's shared worker pool, so all clients share the
+    tool handlers, the GitLab session and the caches of this process. Progress
+    notifications are only sent on SSE streams.
+
+    Request ids are only unique within a client, so cancellation needs a
+    session: initialize issues an Mcp-Session-Id, and a cancel notification
+    only reaches calls posted with the same one. A cancelled tool call ends its
+    POST with 202 Accepted, or a stream without a response. Without a session
+    header every POST stands alone and cancel notifications are ignored.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "GitLabMCP/0.1"
+    # Sent with the response to an initialize request
+    issued_session_id = None
+
+    def do_POST(self):
+        self.issued_session_id = None
+        if urllib.parse.urlsplit(self.path).path != MCP_HTTP_PATH:
+            return self.send_plain(404, "Not Found")
+        if not self.origin_allowed():
+            return self.send_plain(403, "Forbidden origin")
+        if self.headers.get("Content-Length") is None:
+            return self.send_plain(411, "Length Required")
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        try:
+            msg = json_codec.decode(body)
+        except ValueError:
+            return self.send_json(400, {"jsonrpc": "2.0", "id": None,
+                                        "error": {"code": -32700, "message": "Parse error"}})
+        if not (isinstance(msg, dict) or isinstance(msg, list) and msg):
+            return self.send_json(400, error_response({}, -32600, "Invalid request"))
+        messages = msg if isinstance(msg, list) else [msg]
+        session_id = self.headers.get("Mcp-Session-Id")
+        if session_id is not None:
+            calls = self.server.sessions.get(session_id)
+            if calls is None:
+                return self.send_plain(404, "Session not found")
+        elif any(isinstance(m, dict) and m.get("method") == "initialize" for m in messages):
+            self.issued_session_id = self.server.sessions.create()
+            calls = self.server.sessions.get(self.issued_session_id)
         else:
-            respond({
-                "jsonrpc": "2.0",
-                "id": msg.get("id"),
-                "error": {
-                    "code": -32601,
-                    "message": f"Unknown message type: {msg_type}"
-                }
-            })
+            calls = CallRegistry()
+        if all(isinstance(m, dict) and "id" not in m for m in messages):
+            # Notifications have no response
+            for notification in messages:
+                handle_notification(notification, calls)
+            return self.send_plain(202, "")
+        stream = None
+        if "text/event-stream" in self.headers.get("Accept", ""):
+            # Opened up front so that progress notifications can precede the response
+            stream = SSEStream(self)
+        if isinstance(msg, list):
+            response = submit_batch(msg, calls, self.server.executor, stream.send if stream else None).result()
+        elif msg.get("method") == "tools/call":
+            context = calls.start(msg["id"], progress_token(msg), stream.send if stream else None)
+            try:
+                response = self.server.executor.submit(call_tool, msg, context).result()
+            finally:
+                calls.finish(context)
+        else:
+            response = handle_message(msg)
+        if stream is not None:
+            if response is not None:
+                stream.send(response)
+            stream.close()
+        elif response is None:
+            # The call was cancelled; it gets no JSON-RPC response
+            self.send_plain(202, "")
+        else:
+            self.send_json(200, response)
+
+    def do_GET(self):
+        # There are no server-initiated messages to stream outside of a request
+        self.send_plain(405, "Method Not Allowed", {"Allow": "POST, DELETE"})
+
+    def do_DELETE(self):
+        """End the session named by the Mcp-Session-Id header"""
+        self.issued_session_id = None
+        if urllib.parse.urlsplit(self.path).path != MCP_HTTP_PATH:
+            return self.send_plain(404, "Not Found")
+        if not self.origin_allowed():
+            return self.send_plain(403, "Forbidden origin")
+        session_id = self.headers.get("Mcp-Session-Id")
+        if session_id is None:
+            return self.send_plain(400, "Missing Mcp-Session-Id")
+        if not self.server.sessions.end(session_id):
+            return self.send_plain(404, "Session not found")
+        self.send_plain(200, "")
+
+    def end_headers(self):
+        if self.issued_session_id is not None:
+            self.send_header("Mcp-Session-Id", self.issued_session_id)
+        super().end_headers()
+
+    def origin_allowed(self):
+        """Reject browser requests from other sites, which could reach a localhost server by DNS rebinding"""
+        origin = self.headers.get("Origin")
+        if not origin:
+            return True
+        return urllib.parse.urlsplit(origin).hostname in ("localhost", "127.0.0.1", "::1", MCP_HTTP_HOST)
+
+    def send_json(self, status, obj):
+        body = json_codec.encode(obj)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_plain(self, status, text, headers=None):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep stderr quiet; MCP clients often surface it as errors
+        pass
+
+
+def create_http_server(host=None, port=None):
+    """Create the HTTP transport server, with its own pool of MCP_MAX_WORKERS tool workers"""
+    server = ThreadingHTTPServer((host or MCP_HTTP_HOST, MCP_HTTP_PORT if port is None else port),
+                                 MCPHTTPRequestHandler)
+    server.daemon_threads = True
+    server.executor = ThreadPoolExecutor(max_workers=MCP_MAX_WORKERS, thread_name_prefix="mcp-tool")
+    server.sessions = HTTPSessions()
+    return server
+
+
+def serve_http():
+    """Serve MCP over HTTP until interrupted"""
+    server = create_http_server()
+    host, port = server.server_address[:2]
+    sys.stderr.write(f"GitLab MCP server listening on http://{host}:{port}{MCP_HTTP_PATH}\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(wait=True)
+
+
+DAEMON_HELLO = b"MCP-DAEMON "
+
+
+def daemon_fingerprint():
+    """Digest of the GitLab settings this process serves; a shim only uses a daemon with the same one"""
+    settings = "\0".join([GITLAB_URL, GITLAB_TOKEN or "", GITLAB_PROJECT_PATH])
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest().encode("ascii")
+
+
+class DaemonConnectionHandler(socketserver.StreamRequestHandler):
+    """Serves one shim connection with the same line protocol as stdio.
+
+    The shim opens with a line naming the fingerprint of its GitLab settings.
+    The daemon answers OK and serves the session, or MISMATCH and hangs up when
+    it was started with another URL, token or project.
+    """
+
+    def handle(self):
+        self.connection.settimeout(MCP_DAEMON_HANDSHAKE_TIMEOUT)
+        try:
+            hello = self.rfile.readline()
+        except OSError:
+            return
+        self.connection.settimeout(None)
+        if not hmac.compare_digest(hello.rstrip(b"\n"), DAEMON_HELLO + self.server.fingerprint):
+            self.wfile.write(b"MISMATCH\n")
+            return
+        if not self.server.connection_opened():
+            # The daemon is going idle; hanging up makes the shim connect again and start a new one
+            return
+        self.wfile.write(b"OK\n")
+        write_lock = threading.Lock()
+        wfile = self.wfile
+
+        def send(obj):
+            line = json_codec.encode(obj) + b"\n"
+            with write_lock:
+                wfile.write(line)
+
+        try:
+            # Answer everything the client sent before it closed its end
+            wait(serve_lines(self.rfile.readline, send, self.server.executor))
+        finally:
+            self.server.connection_closed()
+
+
+class MCPDaemon(socketserver.ThreadingUnixStreamServer):
+    """Warm server process shared by every stdio shim that connects to its socket.
+
+    Connections share one pool of MCP_MAX_WORKERS tool workers along with the
+    GitLab session and caches. The daemon exits once no client has been
+    connected for idle_timeout seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout):
+        super().__init__(path, DaemonConnectionHandler)
+        self.idle_timeout = idle_timeout
+        self.fingerprint = daemon_fingerprint()
+        self.executor = ThreadPoolExecutor(max_workers=MCP_MAX_WORKERS, thread_name_prefix="mcp-tool")
+        self._connections = 0
+        self._idle_since = time.monotonic()
+        self._closing = False
+        self._lock = threading.Lock()
+
+    def connection_opened(self):
+        """Count a new connection; returns False once the daemon has decided to shut down"""
+        with self._lock:
+            if self._closing:
+                return False
+            self._connections += 1
+            return True
+
+    def connection_closed(self):
+        with self._lock:
+            self._connections -= 1
+            self._idle_since = time.monotonic()
+
+    def close_if_idle(self):
+        """Stop taking connections when none has been open for idle_timeout seconds; returns whether it did"""
+        with self._lock:
+            if not self._connections and time.monotonic() - self._idle_since >= self.idle_timeout:
+                self._closing = True
+            return self._closing
+
+    def serve_until_idle(self):
+        def watch_idle():
+            while not self.close_if_idle():
+                time.sleep(min(1.0, self.idle_timeout))
+            self.shutdown()
+
+        threading.Thread(target=watch_idle, name="mcp-daemon-idle", daemon=True).start()
+        self.serve_forever()
+
+
+def serve_daemon(path=None, idle_timeout=None):
+    """Run the daemon on a Unix socket until it has been idle for idle_timeout seconds"""
+    import fcntl
+    path = path or MCP_DAEMON_SOCKET
+    if not path:
+        raise ValueError("MCP_DAEMON_SOCKET is not set")
+    # Only one daemon per socket: a second one started by a racing shim exits here
+    lock_file = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return
+    try:
+        if os.path.exists(path):
+            # Left behind by a daemon that did not shut down cleanly; the lock says it is gone
+            os.unlink(path)
+        # The socket gives access to the GitLab token, so only this user may connect
+        old_umask = os.umask(0o077)
+        try:
+            server = MCPDaemon(path, MCP_DAEMON_IDLE_TIMEOUT if idle_timeout is None else idle_timeout)
+        finally:
+            os.umask(old_umask)
+        try:
+            server.serve_until_idle()
+        finally:
+            server.server_close()
+            os.unlink(path)
+            server.executor.shutdown(wait=True)
+    finally:
+        lock_file.close()
+
+
+def start_daemon(path):
+    """Start a detached daemon process listening on path"""
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MCP_TRANSPORT="daemon", MCP_DAEMON_SOCKET=path)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (package_root, env.get("PYTHONPATH")) if p)
+    subprocess.Popen(
+        [sys.executable, "-c", "from gitlab_mcp_server import mcp_server; mcp_server.main()"],
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True, close_fds=True
+    )
+
+
+def connect_daemon(path, start=True, timeout=5.0):
+    """Connect to the daemon on path, starting it first if nothing is listening.
+
+    Returns the connected socket once the daemon has confirmed that it serves the
+    same GitLab settings, or None when no such daemon could be reached.
+    """
+    deadline = time.monotonic() + timeout
+    started = None
+    while True:
+        sock = try_connect(path)
+        if sock is not None:
+            reply = daemon_handshake(sock)
+            if reply == b"OK":
+                return sock
+            sock.close()
+            if reply is not None:
+                return None
+            # Hung up before answering: the daemon is shutting down, so wait for it to go
+        elif not start:
+            return None
+        elif started is None or time.monotonic() - started >= 1.0:
+            # A daemon started while the old one still holds the lock exits at once, so start another later
+            start_daemon(path)
+            started = time.monotonic()
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.05)
+
+
+def daemon_handshake(sock):
+    """Send the settings fingerprint and return the daemon's answer, or None when the connection failed"""
+    sock.settimeout(MCP_DAEMON_HANDSHAKE_TIMEOUT)
+    reply = b""
+    try:
+        sock.sendall(DAEMON_HELLO + daemon_fingerprint() + b"\n")
+        # The daemon sends nothing else before the shim's first request, so this reads only the answer
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(64)
+            if not chunk:
+                return None
+            reply += chunk
+    except OSError:
+        return None
+    sock.settimeout(None)
+    return reply.rstrip(b"\n")
+
+
+def try_connect(path):
+    """Connect to the Unix socket at path, or return None when nothing is listening"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def run_shim(sock):
+    """Forward stdin to the daemon and its responses to stdout until the daemon closes the connection"""
+    def forward_stdin():
+        stdin = sys.stdin.buffer
+        try:
+            while True:
+                data = stdin.read1(65536)
+                if not data:
+                    break
+                sock.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    threading.Thread(target=forward_stdin, name="mcp-shim-stdin", daemon=True).start()
+    stdout = sys.stdout.buffer
+    try:
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                # The daemon died; end the session as if it had closed the connection
+                break
+            if not data:
+                break
+            stdout.write(data)
+            stdout.flush()
+    finally:
+        sock.close()
+
+
+def main():
+    """Main entry point for the GitLab MCP server"""
+    if MCP_TRANSPORT == "http":
+        return serve_http()
+    if MCP_TRANSPORT == "daemon":
+        return serve_daemon()
+    if MCP_DAEMON_SOCKET and hasattr(socket, "AF_UNIX"):
+        sock = connect_daemon(MCP_DAEMON_SOCKET)
+        if sock is not None:
+            return run_shim(sock)
+        # Without a daemon, serve this session in-process as usual
+    executor = ThreadPoolExecutor(max_workers=MCP_MAX_WORKERS, thread_name_prefix="mcp-tool")
+    try:
+        serve_lines(sys.stdin.readline, respond, executor)
+    finally:
+        # Let in-flight tool calls finish and respond before exiting
+        executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
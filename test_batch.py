@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for JSON-RPC batch requests
+"""
+import http.client
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import MRChangesCache, SingleFlight  # noqa: E402
+
+CHANGES = [{"new_path": "a.py", "old_path": "a.py", "diff": "@@ -1,1 +1,2 @@\n ctx\n+added\n"}]
+
+
+def run_server(lines, monkeypatch):
+    """Feed raw lines to main() and return the decoded output lines"""
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdin", io.StringIO("".join(line + "\n" for line in lines)))
+    monkeypatch.setattr(sys, "stdout", stdout)
+    mcp_server.main()
+    return [json.loads(out) for out in stdout.getvalue().splitlines()]
+
+
+def call(request_id, name, arguments=None):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+            "params": {"name": name, "arguments": arguments or {}}}
+
+
+def test_batch_runs_concurrently_and_answers_once(monkeypatch):
+    both_running = threading.Barrier(2, timeout=5)
+
+    def rendezvous(params):
+        both_running.wait()
+        return str(params["n"])
+
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "rendezvous", rendezvous)
+    batch = [
+        call(1, "rendezvous", {"n": 1}),
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        call(2, "rendezvous", {"n": 2}),
+        {"jsonrpc": "2.0", "id": 3, "method": "tools/list"},
+        5,
+    ]
+    output = run_server([json.dumps(batch), json.dumps({"jsonrpc": "2.0", "id": 4, "method": "initialize"})],
+                        monkeypatch)
+    assert [o["id"] for o in output if isinstance(o, dict)] == [4]
+    responses = next(o for o in output if isinstance(o, list))
+    by_id = {r["id"]: r for r in responses}
+    assert set(by_id) == {1, 2, 3, None}
+    assert by_id[1]["result"]["content"][0]["text"] == "1"
+    assert by_id[2]["result"]["content"][0]["text"] == "2"
+    assert "tools" in by_id[3]["result"]
+    assert by_id[None]["error"]["code"] == -32600
+
+
+def test_empty_and_notification_only_batches(monkeypatch):
+    output = run_server(["[]", json.dumps([{"jsonrpc": "2.0", "method": "notifications/initialized"}])], monkeypatch)
+    assert output == [{"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid request"}}]
+
+
+def test_batch_calls_share_one_changes_fetch(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url):
+        fetched.append(url)
+        time.sleep(0.1)
+        if url.endswith("/changes"):
+            return {"diff_refs": {"head_sha": "h1"}, "changes": CHANGES}
+        return {"iid": 1, "diff_refs": {"head_sha": "h1"}}
+
+    monkeypatch.setattr(mcp_server, "fetch_json_revalidated", fake_fetch)
+    monkeypatch.setattr(mcp_server, "read_flights", SingleFlight())
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10 ** 6, 60))
+    batch = [
+        call(1, "get_merge_request_diff_stats", {"mr_iid": 1}),
+        call(2, "get_merge_request_commentable_lines", {"mr_iid": 1}),
+        call(3, "fetch_merge_request_diff", {"mr_iid": 1}),
+    ]
+    responses, = run_server([json.dumps(batch)], monkeypatch)
+    assert sorted(r["id"] for r in responses) == [1, 2, 3]
+    assert all("result" in r for r in responses)
+    assert len([url for url in fetched if url.endswith("/changes")]) == 1
+
+
+def test_http_batch(monkeypatch):
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "echo", lambda params: params["text"])
+    server = mcp_server.create_http_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(body):
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+        connection.request("POST", "/mcp", body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    try:
+        status, body = post([call(1, "echo", {"text": "a"}), call(2, "echo", {"text": "b"})])
+        assert status == 200
+        assert sorted(r["result"]["content"][0]["text"] for r in json.loads(body)) == ["a", "b"]
+        assert post([{"jsonrpc": "2.0", "method": "notifications/initialized"}]) == (202, b"")
+        status, body = post([])
+        assert status == 400 and json.loads(body)["error"]["code"] == -32600
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown(wait=True)
+
+
+def test_batch_is_answered_when_a_call_fails(monkeypatch):
+    call_tool = mcp_server.call_tool
+
+    def failing_call_tool(msg, context):
+        if msg["id"] == 2:
+            raise RuntimeError("boom")
+        return call_tool(msg, context)
+
+    monkeypatch.setattr(mcp_server, "call_tool", failing_call_tool)
+    batch = [{"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": None},
+             call(2, "hello_world"), call(3, "hello_world")]
+    responses, = run_server([json.dumps(batch)], monkeypatch)
+    by_id = {r["id"]: r for r in responses}
+    assert by_id[1]["error"]["code"] == -32602
+    assert by_id[2]["error"]["code"] == -32603
+    assert "boom" in by_id[2]["error"]["message"]
+    assert "Hello" in by_id[3]["result"]["content"][0]["text"]
+
+
+def test_batch_resolves_when_the_client_is_gone():
+    def send(obj):
+        raise BrokenPipeError()
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        future = mcp_server.submit_batch([call(1, "hello_world"), call(2, "hello_world")],
+                                         mcp_server.CallRegistry(), executor, send, reply=True)
+        assert sorted(r["id"] for r in future.result(timeout=5)) == [1, 2]
+    finally:
+        executor.shutdown(wait=True)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for cancelling in-flight tool calls with notifications/cancelled
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import CallCancelled, CallContext, MRChangesCache, SingleFlight  # noqa: E402
+
+
+class SlowGitLab(BaseHTTPRequestHandler):
+    """Answers MR details at once and trickles a never-ending /changes body"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if not self.path.endswith("/changes"):
+            body = json.dumps({"iid": 1, "diff_refs": {"head_sha": "h1"}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.server.changes_started.set()
+        self.send_response(200)
+        self.send_header("Content-Length", str(10 ** 9))
+        self.end_headers()
+        try:
+            self.wfile.write(b'{"changes": [')
+            while True:
+                self.wfile.write(b'{"new_path": "a.py", "diff": ""},' * 100)
+                time.sleep(0.01)
+        except OSError:
+            self.server.client_gone.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gitlab(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowGitLab)
+    server.daemon_threads = True
+    server.changes_started = threading.Event()
+    server.client_gone = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(mcp_server, "GITLAB_URL", "http://127.0.0.1:%d" % server.server_address[1])
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10 ** 9, 60))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def call(request_id, name, arguments):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": {"name": name, "arguments": arguments}}
+
+
+def cancel(request_id):
+    return {"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": request_id}}
+
+
+def test_cancel_aborts_download_without_response(gitlab):
+    lines = queue.Queue()
+    sent = []
+    executor = ThreadPoolExecutor(max_workers=2)
+    done = []
+    thread = threading.Thread(target=lambda: done.extend(
+        mcp_server.serve_lines(lines.get, sent.append, executor)))
+    thread.start()
+
+    lines.put(json.dumps(call(5, "fetch_merge_request_diff", {"mr_iid": 1})))
+    assert gitlab.changes_started.wait(5)
+    start = time.monotonic()
+    lines.put(json.dumps(cancel(5)))
+    lines.put(json.dumps({"jsonrpc": "2.0", "method": "notifications/unknown"}))
+    lines.put("")
+    thread.join(5)
+    wait(done, timeout=5)
+    executor.shutdown(wait=True)
+
+    assert time.monotonic() - start < 3
+    assert gitlab.client_gone.wait(5)
+    # No response for the cancelled call, and no error for either notification
+    assert sent == []
+    assert mcp_server.mr_changes_cache.stats()["entries"] == 0
+
+
+def test_queued_call_is_cancelled_before_it_starts(monkeypatch):
+    release = threading.Event()
+    ran = []
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "block", lambda params: release.wait(5) and "done")
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "record", lambda params: ran.append(1) or "ran")
+    lines = iter([json.dumps(m) for m in (call(1, "block", {}), call(2, "record", {}), cancel(2))] + [""])
+    sent = []
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = mcp_server.serve_lines(lambda: next(lines), sent.append, executor)
+    release.set()
+    wait(pending, timeout=5)
+    executor.shutdown(wait=True)
+    assert [r["id"] for r in sent] == [1]
+    assert ran == []
+
+
+def test_single_flight_followers_retry_after_cancelled_leader():
+    flights = SingleFlight()
+    leader_running = threading.Event()
+    follower_waiting = threading.Event()
+    runs = []
+
+    def fetch():
+        runs.append(threading.current_thread().name)
+        if len(runs) == 1:
+            leader_running.set()
+            follower_waiting.wait(5)
+            raise CallCancelled()
+        return "body"
+
+    def leader():
+        with pytest.raises(CallCancelled):
+            flights.do("url", fetch)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    assert leader_running.wait(5)
+    result = []
+    follower = threading.Thread(target=lambda: result.append(flights.do("url", fetch)))
+    follower.start()
+    while flights.stats()["shared"] == 0:
+        time.sleep(0.01)
+    follower_waiting.set()
+    thread.join(5)
+    follower.join(5)
+    assert result == ["body"]
+    assert len(runs) == 2
+
+
+def test_cancelled_single_flight_follower_stops_waiting():
+    flights = SingleFlight()
+    leader_running = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        leader_running.set()
+        release.wait(5)
+        return "body"
+
+    leader = threading.Thread(target=flights.do, args=("url", fetch))
+    leader.start()
+    assert leader_running.wait(5)
+    context = CallContext(1)
+    outcome = []
+
+    def follow():
+        try:
+            outcome.append(mcp_server.run_in_call(context, flights.do, "url", fetch))
+        except CallCancelled:
+            outcome.append("cancelled")
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    while flights.stats()["shared"] == 0:
+        time.sleep(0.01)
+    context.cancel()
+    follower.join(1)
+    # The follower is freed while the leader's fetch is still running
+    assert outcome == ["cancelled"]
+    assert leader.is_alive()
+    release.set()
+    leader.join(5)
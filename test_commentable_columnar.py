@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar commentable lines format
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import line_ranges  # noqa: E402
+
+CHANGES = [
+    {"new_path": "a.py", "old_path": "a.py",
+     "diff": "@@ -10,4 +10,5 @@\n ctx\n-old1\n-old2\n+new1\n+new2\n+new3\n@@ -40,1 +41,1 @@\n+late\n"},
+    {"new_path": "b.py", "old_path": "b.py", "diff": ""},
+]
+
+
+def test_line_ranges():
+    assert line_ranges([]) == []
+    assert line_ranges([3, 4, 5, 9, 11, 12]) == [[3, 3], [9, 1], [11, 2]]
+
+
+def test_columnar_matches_lines_format(monkeypatch):
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", lambda mr_iid: iter(CHANGES))
+    text = mcp_server.tool_get_merge_request_commentable_lines({"mr_iid": 1, "format": "columnar"})
+    assert ": " not in text and "\n " not in text
+    result = json.loads(text)
+    assert result["line_types"] == ["old", "new"]
+    first = result["files"][0]
+    assert first["types"] == [0, 0, 1, 1, 1, 1]
+    assert first["ranges"] == {"old": [[11, 2]], "new": [[11, 3], [41, 1]]}
+    assert result["files"][1] == {"file": "b.py", "types": [], "line_numbers": [], "contents": [],
+                                  "ranges": {"old": [], "new": []}}
+
+    # Zipping the columns back gives exactly the default format
+    rebuilt = [
+        {"file": f["file"], "commentable_lines": [
+            {"type": result["line_types"][t], "line_number": n, "content": c}
+            for t, n, c in zip(f["types"], f["line_numbers"], f["contents"])
+        ]}
+        for f in result["files"]
+    ]
+    default = json.loads(mcp_server.tool_get_merge_request_commentable_lines({"mr_iid": 1}))
+    assert rebuilt == default
+
+
+if __name__ == '__main__':
+    test_line_ranges()
+    print("All columnar format tests passed!")
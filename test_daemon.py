@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared daemon and its stdio shim
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+
+
+def exchange(sock, messages):
+    sock.sendall(b"".join(json.dumps(m).encode() + b"\n" for m in messages))
+    sock.shutdown(socket.SHUT_WR)
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def test_daemon_serves_clients_and_exits_when_idle(monkeypatch):
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "echo", lambda params: params["text"])
+    path = os.path.join(tempfile.mkdtemp(), "mcp.sock")
+    thread = threading.Thread(target=mcp_server.serve_daemon, args=(path, 0.5), daemon=True)
+    thread.start()
+
+    sock = None
+    deadline = time.monotonic() + 5
+    while sock is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+        sock = mcp_server.connect_daemon(path, start=False)
+    assert sock is not None
+    assert os.stat(path).st_mode & 0o077 == 0
+
+    # A second daemon on the same socket gives up at once
+    mcp_server.serve_daemon(path, 0.5)
+    assert thread.is_alive()
+
+    responses = exchange(sock, [
+        {"jsonrpc": "2.0", "id": 1, "method": "tools/list"},
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/call", "params": {"name": "echo", "arguments": {"text": "hi"}}},
+    ])
+    by_id = {r["id"]: r for r in responses}
+    assert "tools" in by_id[1]["result"]
+    assert by_id[2]["result"]["content"][0]["text"] == "hi"
+
+    # A later client reuses the same warm process
+    sock = mcp_server.connect_daemon(path, start=False)
+    assert exchange(sock, [{"jsonrpc": "2.0", "id": 3, "method": "initialize"}])[0]["id"] == 3
+
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not os.path.exists(path)
+    assert mcp_server.connect_daemon(path, start=False) is None
+
+
+
+def test_daemon_turns_away_shims_with_other_settings(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), "mcp.sock")
+    thread = threading.Thread(target=mcp_server.serve_daemon, args=(path, 2.0), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    for name, value in [("GITLAB_TOKEN", "other-token"), ("GITLAB_URL", "https://other.example.com"),
+                        ("GITLAB_PROJECT_PATH", "other/project")]:
+        with monkeypatch.context() as patch:
+            patch.setattr(mcp_server, name, value)
+            assert mcp_server.connect_daemon(path) is None
+
+    # A client that skips the handshake is turned away too
+    sock = mcp_server.try_connect(path)
+    sock.sendall(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/list"}).encode() + b"\n")
+    assert sock.recv(64) == b"MISMATCH\n"
+    sock.close()
+
+    sock = mcp_server.connect_daemon(path, start=False)
+    assert exchange(sock, [{"jsonrpc": "2.0", "id": 2, "method": "initialize"}])[0]["id"] == 2
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_idle_daemon_takes_no_new_connections():
+    path = os.path.join(tempfile.mkdtemp(), "mcp.sock")
+    server = mcp_server.MCPDaemon(path, 0)
+    try:
+        assert server.connection_opened()
+        assert not server.close_if_idle()
+        server.connection_closed()
+        assert server.close_if_idle()
+        assert not server.connection_opened()
+    finally:
+        server.server_close()
+        server.executor.shutdown()
+
+
+def test_shim_reconnects_when_the_daemon_hangs_up_during_the_handshake(monkeypatch):
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "echo", lambda params: params["text"])
+    path = os.path.join(tempfile.mkdtemp(), "mcp.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def shutting_down_then_new_daemon():
+        # Like a daemon that went idle just as the shim connected
+        conn, _ = listener.accept()
+        conn.close()
+        listener.close()
+        mcp_server.serve_daemon(path, 0.5)
+
+    # The thread above plays the part of the daemon the shim would start
+    monkeypatch.setattr(mcp_server, "start_daemon", lambda path: None)
+    thread = threading.Thread(target=shutting_down_then_new_daemon, daemon=True)
+    thread.start()
+    sock = mcp_server.connect_daemon(path)
+    assert sock is not None
+    responses = exchange(sock, [
+        {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": "echo", "arguments": {"text": "hi"}}},
+    ])
+    assert responses[0]["result"]["content"][0]["text"] == "hi"
+    thread.join(10)
+    assert not thread.is_alive()
+
+def test_shim_starts_daemon_on_first_use():
+    path = os.path.join(tempfile.mkdtemp(), "mcp.sock")
+    env = dict(os.environ, MCP_DAEMON_SOCKET=path, MCP_DAEMON_IDLE_TIMEOUT="1",
+               PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    env.pop("MCP_TRANSPORT", None)
+    request = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "initialize"}) + "\n"
+    for _ in range(2):
+        output = subprocess.run(
+            [sys.executable, "-c", "from gitlab_mcp_server import mcp_server; mcp_server.main()"],
+            input=request.encode(), env=env, stdout=subprocess.PIPE, timeout=20, check=True
+        ).stdout
+        assert json.loads(output)["result"]["serverInfo"]["name"] == "Private GitLab MCP"
+        assert os.path.exists(path)
+
+    deadline = time.monotonic() + 10
+    while os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not os.path.exists(path)
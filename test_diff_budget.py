@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for merge request diff summaries: budgeted output and per-file stats
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import FileFilter, MRChangesCache, budget_mr_diff, diff_parser  # noqa: E402
+
+
+def hunk(old_start, new_start, body_lines):
+    return "@@ -%d,3 +%d,4 @@\n" % (old_start, new_start) + "".join(line + "\n" for line in body_lines)
+
+
+BIG_HUNK = hunk(100, 100, [" ctx"] + ["+" + "x" * 80] * 40)
+CHANGES = [
+    {"new_path": "src/small.py", "old_path": "src/small.py", "diff": hunk(1, 1, [" a", "-b", "+c", "+d"])},
+    {"new_path": "src/big.py", "old_path": "src/big.py",
+     "diff": hunk(1, 1, [" a", "+tiny"]) + BIG_HUNK + hunk(300, 340, ["-gone"])},
+    {"new_path": "poetry.lock", "old_path": "poetry.lock", "diff": hunk(1, 1, ["+" + "y" * 60] * 30)},
+]
+
+
+def test_hunks_split_at_headers():
+    diff = CHANGES[1]["diff"]
+    hunks = list(diff_parser.iter_hunks(diff))
+    assert [(a, d) for _, _, a, d in hunks] == [(1, 0), (40, 0), (0, 1)]
+    assert "".join(diff[start:end] for start, end, _, _ in hunks) == diff
+    assert list(diff_parser.iter_hunks("")) == []
+
+
+def test_under_budget_returns_everything():
+    result = budget_mr_diff(CHANGES, 1000000)
+    assert not result["truncated"]
+    assert [f["diff"] for f in result["files"]] == [c["diff"] for c in CHANGES]
+
+
+def test_over_budget_keeps_whole_hunks_of_relevant_files():
+    budget = 2000
+    result = budget_mr_diff(CHANGES, budget)
+    assert result["truncated"]
+    assert len(mcp_server.format_result(result)) <= budget
+    small, big = result["files"]
+    assert small["diff"] == CHANGES[0]["diff"]
+    # The large middle hunk is dropped, the small ones around it are kept whole
+    assert big["diff"] == hunk(1, 1, [" a", "+tiny"]) + hunk(300, 340, ["-gone"])
+    assert big["omitted_hunks"] == [{"header": "@@ -100,3 +100,4 @@", "additions": 40, "deletions": 0}]
+    assert big["fetch"] == {"include": ["/src/big.py"]}
+    # The lockfile is ranked last and only summarized
+    assert result["omitted_files"] == [{"file": "poetry.lock", "diff_bytes": len(CHANGES[2]["diff"]), "hunks": 1,
+                                        "additions": 30, "deletions": 0, "fetch": {"include": ["/poetry.lock"]}}]
+
+
+
+def test_fetch_pointer_selects_bracketed_paths():
+    routes = [dict(c, new_path=path, old_path=path) for c, path in zip(CHANGES, ["app/[id]/page.tsx", "app/i/page.tsx", "app/[...slug]/page.tsx"])]
+    result = budget_mr_diff(routes, 2000)
+    omitted = result["files"][1:] + result["omitted_files"]
+    assert omitted
+    for entry in omitted:
+        path = entry.get("file") or entry["new_path"]
+        assert [c["new_path"] for c in FileFilter(**entry["fetch"]).apply(routes)] == [path]
+
+
+def test_budget_is_sized_for_the_returned_json(monkeypatch):
+    full = budget_mr_diff(CHANGES, 10 ** 6)
+    # Sizes allow for a separator after every entry, so the estimate is a few bytes high
+    compact = len(mcp_server.format_result(full)) + 8
+    assert not budget_mr_diff(CHANGES, compact)["truncated"]
+    monkeypatch.setattr(mcp_server, "MCP_PRETTY_JSON", True)
+    assert len(mcp_server.format_result(full)) > compact
+    assert budget_mr_diff(CHANGES, compact)["truncated"]
+    result = budget_mr_diff(CHANGES, 2000)
+    assert len(mcp_server.format_result(result)) <= 2000
+
+def test_tiny_budget_lists_what_fits():
+    result = budget_mr_diff(CHANGES, 400)
+    assert len(result["files"]) + len(result["omitted_files"]) + result["unlisted_files"] == 3
+
+
+def test_diff_stats_are_computed_once_per_head(monkeypatch):
+    changes = CHANGES + [
+        {"new_path": "logo.png", "old_path": "logo.png", "new_file": True,
+         "diff": "Binary files /dev/null and b/logo.png differ\n"},
+        {"new_path": "huge.sql", "old_path": "old.sql", "renamed_file": True, "too_large": True, "diff": ""},
+    ]
+    reads = []
+
+    def fake_iter_mr_changes(mr_iid, project_path=None, head_sha=None):
+        reads.append(head_sha)
+        mcp_server.mr_changes_cache.put((project_path, str(mr_iid), head_sha), changes)
+        return iter(changes)
+
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10 ** 6, 60))
+    monkeypatch.setattr(mcp_server, "fetch_mr_head_sha", lambda mr_iid, project_path=None: "h1")
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", fake_iter_mr_changes)
+
+    result = mcp_server.fetch_mr_diff_stats(7)
+    assert mcp_server.fetch_mr_diff_stats(7) == result
+    assert reads == ["h1"]
+    assert result["total_files"] == 5
+    assert (result["additions"], result["deletions"]) == (2 + 41 + 30, 1 + 1)
+    big = result["files"][1]
+    assert (big["path"], big["additions"], big["deletions"], big["hunks"]) == ("src/big.py", 41, 1, 3)
+    assert "diff" not in big
+    png, sql = result["files"][3:]
+    assert png["new_file"] and png["binary"] and not png["too_large"]
+    assert sql["renamed_file"] and sql["too_large"] and sql["old_path"] == "old.sql"
+
+    filtered = mcp_server.fetch_mr_diff_stats(7, file_filter=FileFilter(exclude=["*.lock", "old.sql"]))
+    assert [f["path"] for f in filtered["files"]] == ["src/small.py", "src/big.py", "logo.png"]
+
+
+if __name__ == '__main__':
+    test_hunks_split_at_headers()
+    test_under_budget_returns_everything()
+    test_over_budget_keeps_whole_hunks_of_relevant_files()
+    test_tiny_budget_lists_what_fits()
+    print("All diff budget tests passed!")
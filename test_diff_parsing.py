@@ -82,5 +82,75 @@ def test_parse_diff():
     
     print("All diff parsing tests passed!")
 
+def test_package_parser_matches_reference():
+    """The array-backed parser returns exactly what the reference parser does"""
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    from gitlab_mcp_server.mcp_server import diff_parser, parse_diff_for_line_numbers as package_parse
+
+    samples = [
+        "",
+        "+only added\n",
+        "@@ -10,5 +10,6 @@ def hello():\n     print(1)\n-    old\n+    new\n+    added\n",
+        "--- a/x.py\n+++ b/x.py\n@@ -1 +1 @@\n-a\r\n+b\r\n\\ No newline at end of file",
+        "@@ -3,2 +4,3 @@\n x\n+++y\n---z\n+\n-\n@@ bogus\n+after bogus\n@@ -20 +30 @@\n+moved",
+    ]
+    for sample in samples:
+        assert package_parse(sample) == parse_diff_for_line_numbers(sample)
+
+    parsed = diff_parser.parse(samples[2])
+    assert len(parsed) == 3
+    assert list(parsed.line_numbers) == [11, 11, 12]
+    assert parsed.content(2) == '    added'
+    assert parsed.line(0) == {'type': 'old', 'line_number': 11, 'content': '    old'}
+    print("Package diff parser matches the reference parser!")
+
+def test_parallel_parsing_keeps_file_order():
+    """Large merge requests parsed in the process pool come back in file order"""
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    from gitlab_mcp_server import mcp_server
+
+    changes = [
+        {"new_path": "f%d.py" % i, "diff": "@@ -%d,1 +%d,2 @@\n-x\n+y\n+%s\n" % (i, i, "z" * (i * 5000))}
+        for i in range(1, 60)
+    ]
+    saved = mcp_server.GITLAB_PARSE_PROCESSES, mcp_server.GITLAB_PARSE_PARALLEL_MIN_BYTES
+    mcp_server.GITLAB_PARSE_PROCESSES, mcp_server.GITLAB_PARSE_PARALLEL_MIN_BYTES = 2, 100000
+    try:
+        parsed = list(mcp_server.iter_parsed_changes(changes))
+    finally:
+        mcp_server.GITLAB_PARSE_PROCESSES, mcp_server.GITLAB_PARSE_PARALLEL_MIN_BYTES = saved
+        mcp_server.reset_parse_pool()
+    assert [change["new_path"] for change, _ in parsed] == [change["new_path"] for change in changes]
+    for change, lines in parsed:
+        assert lines.to_dicts() == parse_diff_for_line_numbers(change["diff"])
+    print("Parallel diff parsing keeps file order!")
+
+def test_streamed_commentable_lines_match_dumps(monkeypatch):
+    """The per-file JSON chunks join to exactly the json.dumps output of the list form"""
+    import json
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    from gitlab_mcp_server import mcp_server
+    from gitlab_mcp_server.mcp_server import FileFilter
+
+    changes = [
+        {"new_path": "src/app/main.py", "old_path": "src/app/main.py", "diff": "@@ -1,1 +1,2 @@\n ctx\n+a\n"},
+        {"new_path": "caf\u00e9/\"q\".py", "old_path": "x", "diff": "@@ -3,2 +3,2 @@\n-\u00e9\t\\\n+new\n ctx\n+\U0001f600"},
+        {"new_path": "empty.txt", "old_path": "empty.txt", "diff": ""},
+        {"new_path": "big.py", "old_path": "big.py", "diff": "+e\n" * 100},
+    ]
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", lambda mr_iid: iter(changes))
+    for file_filter in (None, FileFilter(max_diff_bytes_per_file=50), FileFilter(include=["nothing/**"])):
+        expected = json.dumps(mcp_server.get_mr_commentable_lines(1, file_filter), indent=2)
+        assert "".join(mcp_server.iter_mr_commentable_lines_json(1, file_filter)) == expected
+
+
 if __name__ == '__main__':
-    test_parse_diff()
\ No newline at end of file
+    test_parse_diff()
+    test_package_parser_matches_reference()
+    test_parallel_parsing_keeps_file_order()
\ No newline at end of file
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the concurrent tool-call dispatcher in main()
+"""
+import io
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+
+
+def run_server(lines, monkeypatch):
+    """Feed lines to main() and return the decoded responses in output order"""
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdin", io.StringIO("".join(json.dumps(m) + "\n" for m in lines)))
+    monkeypatch.setattr(sys, "stdout", stdout)
+    mcp_server.main()
+    return [json.loads(out) for out in stdout.getvalue().splitlines()]
+
+
+def test_slow_tool_call_does_not_block_others(monkeypatch):
+    """A fast tool call queued behind a slow one is answered first"""
+    release = threading.Event()
+
+    def slow_tool(params):
+        release.wait(5)
+        return "slow"
+
+    def fast_tool(params):
+        release.set()
+        return "fast"
+
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "slow_tool", slow_tool)
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "fast_tool", fast_tool)
+
+    responses = run_server([
+        {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": "slow_tool", "arguments": {}}},
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/call", "params": {"name": "fast_tool", "arguments": {}}},
+        {"jsonrpc": "2.0", "id": 3, "method": "tools/list"},
+    ], monkeypatch)
+
+    ids = [r["id"] for r in responses]
+    assert sorted(ids) == [1, 2, 3]
+    assert ids.index(2) < ids.index(1)
+    texts = {r["id"]: r["result"]["content"][0]["text"] for r in responses if r["id"] != 3}
+    assert texts == {1: "slow", 2: "fast"}
+
+
+def test_unknown_tool_returns_error(monkeypatch):
+    """An unknown tool name gets a JSON-RPC error instead of no answer"""
+    responses = run_server([
+        {"jsonrpc": "2.0", "id": 7, "method": "tools/call", "params": {"name": "nope", "arguments": {}}},
+    ], monkeypatch)
+    assert responses[0]["id"] == 7
+    assert responses[0]["error"]["code"] == -32601
+
+
+def test_malformed_params_get_invalid_params_error(monkeypatch):
+    """A tools/call whose params are not an object is answered, not dropped"""
+    responses = run_server([
+        {"jsonrpc": "2.0", "id": n, "method": "tools/call", "params": params}
+        for n, params in ((1, None), (2, "hello_world"), (3, ["hello_world"]))
+    ], monkeypatch)
+    assert sorted(r["id"] for r in responses) == [1, 2, 3]
+    assert all(r["error"]["code"] == -32602 for r in responses)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for fetching the diffs of several merge requests in parallel
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import fetch_mr_diffs  # noqa: E402
+
+
+def test_results_keep_input_order_and_isolate_failures(monkeypatch):
+    def fake_fetch_mr_diff(mr_iid, project_path=None):
+        # The first merge request finishes last
+        time.sleep(0.1 if mr_iid == 1 else 0)
+        if mr_iid == 2:
+            raise RuntimeError("404 Not Found")
+        return [{"file": f"{mr_iid}.py", "diff": "", "project_path": project_path}]
+
+    monkeypatch.setattr(mcp_server, "fetch_mr_diff", fake_fetch_mr_diff)
+    monkeypatch.setattr(mcp_server, "GITLAB_PROJECT_PATH", "default/project")
+    results = fetch_mr_diffs([
+        {"mr_iid": 1, "project_path": "g/a"},
+        {"mr_iid": 2, "project_path": "g/b"},
+        {"mr_iid": 3},
+    ])
+    assert [(r["project_path"], r["mr_iid"]) for r in results] == [("g/a", 1), ("g/b", 2), ("default/project", 3)]
+    assert results[0]["diff"] == [{"file": "1.py", "diff": "", "project_path": "g/a"}]
+    assert results[1] == {"project_path": "g/b", "mr_iid": 2, "error": "404 Not Found"}
+    # A missing project_path is passed down as None and resolved by fetch_mr_diff
+    assert results[2]["diff"][0]["project_path"] is None
+
+
+def test_concurrency_is_capped(monkeypatch):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_fetch_mr_diff(mr_iid, project_path=None):
+        with lock:
+            running.append(mr_iid)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(mr_iid)
+        return []
+
+    monkeypatch.setattr(mcp_server, "fetch_mr_diff", fake_fetch_mr_diff)
+    results = fetch_mr_diffs([{"mr_iid": i} for i in range(10)], max_concurrency=3)
+    assert [r["mr_iid"] for r in results] == list(range(10))
+    assert max(peak) == 3
+    assert fetch_mr_diffs([]) == []
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for server-side file filtering of merge request diffs
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server.mcp_server import FileFilter, glob_escape, glob_to_regex  # noqa: E402
+
+CHANGES = [
+    {"new_path": "src/app/main.py", "old_path": "src/app/main.py", "diff": "+a\n"},
+    {"new_path": "src/gen/api.pb.go", "old_path": "src/gen/api.pb.go", "diff": "+b\n"},
+    {"new_path": "poetry.lock", "old_path": "poetry.lock", "diff": "+c\n"},
+    {"new_path": "vendor/lib/x.go", "old_path": "vendor/lib/x.go", "diff": "+d\n"},
+    {"new_path": "src/moved.py", "old_path": "legacy/moved.py", "diff": "+e\n" * 100},
+]
+
+
+def test_glob_semantics():
+    assert glob_to_regex("src/**").match("src/a/b.py")
+    assert not glob_to_regex("src/**").match("lib/src/a.py")
+    assert glob_to_regex("*.lock").match("a/b/Cargo.lock")
+    assert not glob_to_regex("src/*.py").match("src/a/b.py")
+    assert glob_to_regex("**/*.pb.go").match("api.pb.go")
+    assert glob_to_regex("/README.md").match("README.md")
+    assert not glob_to_regex("/README.md").match("docs/README.md")
+
+
+
+def test_escaped_paths_match_only_themselves():
+    paths = ["app/[id]/page.tsx", "app/i/page.tsx", "app/d/page.tsx", "docs/*.md", "docs/a.md", "q?.txt", "qa.txt"]
+    for path in paths:
+        pattern = glob_to_regex("/" + glob_escape(path))
+        assert [p for p in paths if pattern.match(p)] == [path]
+
+def test_include_exclude_and_size_cap():
+    file_filter = FileFilter(include=["src/**"], exclude=["*.pb.go"], max_diff_bytes_per_file=50)
+    kept = list(file_filter.apply(CHANGES))
+    assert [c["new_path"] for c in kept] == ["src/app/main.py", "src/moved.py"]
+    assert kept[0] is CHANGES[0]
+    assert kept[1]["diff"] == ""
+    assert kept[1]["omitted_diff_bytes"] == 300
+    # The cached change itself is left untouched
+    assert CHANGES[4]["diff"].startswith("+e")
+
+
+def test_renamed_files_match_old_path():
+    kept = list(FileFilter(include=["legacy/**"]).apply(CHANGES))
+    assert [c["new_path"] for c in kept] == ["src/moved.py"]
+
+
+def test_no_arguments_means_no_filter():
+    assert FileFilter.from_params({"mr_iid": 1}) is None
+    assert FileFilter.from_params({"exclude": ["*.lock"]}).exclude == ["*.lock"]
+
+
+if __name__ == '__main__':
+    test_glob_semantics()
+    test_include_exclude_and_size_cap()
+    test_renamed_files_match_old_path()
+    test_no_arguments_means_no_filter()
+    print("All file filter tests passed!")
+
+
+def test_bare_string_globs_are_one_glob():
+    kept = FileFilter.from_params({"exclude": "*.lock", "include": "src/**"}).apply(CHANGES)
+    assert [c["new_path"] for c in kept] == ["src/app/main.py", "src/gen/api.pb.go", "src/moved.py"]
+    for bad in ({"include": [1]}, {"exclude": {"a": 1}}):
+        with pytest.raises(ValueError):
+            FileFilter.from_params(bad)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for the streamable HTTP transport
+"""
+import http.client
+import json
+import os
+import queue
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    server = mcp_server.create_http_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.executor.shutdown(wait=True)
+
+
+def post(server, body, headers=None, path="/mcp", connection=None):
+    connection = connection or http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    connection.request("POST", path, body=data, headers=dict({"Content-Type": "application/json"}, **(headers or {})))
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_json_and_sse_responses_share_one_process(server, monkeypatch):
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "echo", lambda params: params["text"])
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+
+    response, body = post(server, {"jsonrpc": "2.0", "id": 1, "method": "initialize"}, connection=connection)
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "application/json"
+    assert json.loads(body)["result"]["serverInfo"]["name"] == "Private GitLab MCP"
+
+    # Same keep-alive connection, now asking for an event stream
+    call = {"jsonrpc": "2.0", "id": 2, "method": "tools/call", "params": {"name": "echo", "arguments": {"text": "hi"}}}
+    response, body = post(server, call, {"Accept": "application/json, text/event-stream"}, connection=connection)
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "text/event-stream"
+    events = [e for e in body.decode().split("\n\n") if e]
+    assert events[0].startswith("event: message\ndata: ")
+    message = json.loads(events[0].split("data: ", 1)[1])
+    assert message["id"] == 2
+    assert message["result"]["content"][0]["text"] == "hi"
+
+
+def test_concurrent_clients(server, monkeypatch):
+    both_running = threading.Barrier(2, timeout=5)
+
+    def rendezvous(params):
+        both_running.wait()
+        return str(params["n"])
+
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "rendezvous", rendezvous)
+    results = {}
+
+    def client(n):
+        call = {"jsonrpc": "2.0", "id": n, "method": "tools/call", "params": {"name": "rendezvous", "arguments": {"n": n}}}
+        results[n] = json.loads(post(server, call)[1])["result"]["content"][0]["text"]
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert results == {1: "1", 2: "2"}
+
+
+def test_notifications_errors_and_origin(server):
+    response, body = post(server, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+    assert response.status == 202 and body == b""
+
+    response, body = post(server, b"{nope")
+    assert response.status == 400
+    assert json.loads(body)["error"]["code"] == -32700
+
+    response, _ = post(server, {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}, {"Origin": "https://evil.example"})
+    assert response.status == 403
+    response, _ = post(server, {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}, {"Origin": "http://localhost:3000"})
+    assert response.status == 200
+
+    response, _ = post(server, {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}, path="/other")
+    assert response.status == 404
+
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    connection.request("GET", "/mcp")
+    response = connection.getresponse()
+    assert response.status == 405
+    assert response.getheader("Allow") == "POST, DELETE"
+
+
+def test_cancellation_is_scoped_to_the_session(server, monkeypatch):
+    started = queue.Queue()
+    release = threading.Event()
+
+    def hold(params):
+        started.put(params["n"])
+        while not release.wait(0.01):
+            mcp_server.check_cancelled()
+        return "done"
+
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "hold", hold)
+    sessions = []
+    for _ in range(2):
+        response, _ = post(server, {"jsonrpc": "2.0", "id": 0, "method": "initialize"})
+        sessions.append(response.getheader("Mcp-Session-Id"))
+    client_a, client_b = sessions
+    assert client_a and client_b and client_a != client_b
+
+    def call(n, session):
+        message = {"jsonrpc": "2.0", "id": n, "method": "tools/call", "params": {"name": "hold", "arguments": {"n": n}}}
+        results[n] = post(server, message, {"Mcp-Session-Id": session})
+
+    def cancel(session=None):
+        message = {"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": 2}}
+        response, _ = post(server, message, {"Mcp-Session-Id": session} if session else None)
+        assert response.status == 202
+
+    # Request id 2 is client B's call; cancels of that id by anyone else are ignored
+    results = {}
+    threads = [threading.Thread(target=call, args=(n, session)) for n, session in ((1, client_a), (2, client_b))]
+    for thread in threads:
+        thread.start()
+    assert sorted([started.get(timeout=5), started.get(timeout=5)]) == [1, 2]
+    cancel()
+    cancel(client_a)
+    threads[1].join(0.2)
+    assert threads[1].is_alive()
+    cancel(client_b)
+    threads[1].join(5)
+    assert results[2][0].status == 202
+    release.set()
+    threads[0].join(5)
+    assert json.loads(results[1][1])["result"]["content"][0]["text"] == "done"
+
+    # Ended and unknown sessions are rejected
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    connection.request("DELETE", "/mcp", headers={"Mcp-Session-Id": client_a})
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 200
+    response, _ = post(server, {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}, {"Mcp-Session-Id": client_a})
+    assert response.status == 404
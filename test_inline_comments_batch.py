@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the batch inline comment tool
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+
+SAMPLE_CHANGES = [
+    {
+        "new_path": "src/app.py",
+        "old_path": "src/app.py",
+        "diff": "@@ -10,3 +10,4 @@\n context\n-old line\n+new line\n+added line\n"
+    },
+    {"new_path": "huge.json", "old_path": "huge.json", "diff": ""},
+]
+
+
+def patch_changes(monkeypatch):
+    mcp_server.mr_changes_cache.clear()
+    monkeypatch.setattr(mcp_server, "iter_mr_changes",
+                        lambda mr_iid, project_path=None, head_sha=None: iter(SAMPLE_CHANGES))
+
+
+def test_batch_validates_positions_and_posts_once_per_comment(monkeypatch):
+    details_calls = []
+    posted = []
+    lock = threading.Lock()
+
+    def fake_details(mr_iid):
+        details_calls.append(mr_iid)
+        return {"diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h"}}
+
+    def fake_post(mr_iid, body, position):
+        with lock:
+            posted.append(position)
+            return {"id": f"d{len(posted)}"}
+
+    monkeypatch.setattr(mcp_server, "fetch_mr_details", fake_details)
+    patch_changes(monkeypatch)
+    monkeypatch.setattr(mcp_server, "post_mr_discussion", fake_post)
+
+    results = mcp_server.add_mr_inline_comments_batch(5, [
+        {"file_path": "src/app.py", "line_number": 11, "comment_body": "a"},
+        {"file_path": "src/app.py", "line_number": 11, "comment_body": "b", "line_type": "old"},
+        {"file_path": "src/app.py", "line_number": 10, "comment_body": "context only"},
+        {"file_path": "missing.py", "line_number": 1, "comment_body": "c"},
+        {"file_path": "huge.json", "line_number": 3, "comment_body": "not checkable locally"},
+        {"file_path": "src/app.py", "line_number": 12},
+    ], max_concurrency=2)
+
+    assert details_calls == [5]
+    assert [r["status"] for r in results] == ["posted", "posted", "invalid", "invalid", "posted", "invalid"]
+    assert results[2]["suggestions"] == [{"line_number": 11, "line_type": "new"},
+                                         {"line_number": 12, "line_type": "new"}]
+    assert results[1]["status"] == "posted" and "suggestions" not in results[1]
+    assert len(posted) == 3
+    assert {p.get("new_line") or p.get("old_line") for p in posted} == {11, 3}
+    assert all(p["head_sha"] == "h" for p in posted)
+
+
+def test_batch_isolates_post_failures(monkeypatch):
+    def fake_post(mr_iid, body, position):
+        if body == "boom":
+            raise RuntimeError("400 Bad Request")
+        return {"id": "ok"}
+
+    monkeypatch.setattr(mcp_server, "fetch_mr_details",
+                        lambda mr_iid: {"diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h"}})
+    patch_changes(monkeypatch)
+    monkeypatch.setattr(mcp_server, "post_mr_discussion", fake_post)
+
+    results = mcp_server.add_mr_inline_comments_batch(5, [
+        {"file_path": "src/app.py", "line_number": 11, "comment_body": "boom"},
+        {"file_path": "src/app.py", "line_number": 12, "comment_body": "fine"},
+    ])
+    assert results[0]["status"] == "failed"
+    assert "400" in results[0]["error"]
+    assert results[1] == {"index": 1, "file_path": "src/app.py", "line_number": 12, "line_type": "new",
+                          "status": "posted", "discussion_id": "ok"}
+
+
+def test_position_index_lookup_and_suggestions():
+    index = mcp_server.PositionIndex.from_changes(SAMPLE_CHANGES + [
+        {"new_path": "b.py", "old_path": "b.py", "diff": "@@ -1,1 +1,1 @@\n+one\n@@ -40,1 +40,2 @@\n x\n+41\n+42\n"},
+    ])
+    assert index.check("b.py", 41)["valid"]
+    assert index.check("src/app.py", 11, "old")["valid"]
+    assert index.nearest("b.py", 20, "new") == [1, 41]
+    assert index.nearest("b.py", 30, "new", limit=3) == [41, 42, 1]
+    missed = index.check("b.py", 43)
+    assert not missed["valid"]
+    assert missed["suggestions"] == [{"line_number": 42, "line_type": "new"}, {"line_number": 41, "line_type": "new"}]
+    assert index.check("huge.json", 7) == {"file_path": "huge.json", "line_number": 7, "line_type": "new",
+                                           "valid": True, "checked": False}
+    assert "not part of" in index.check("nope.py", 1)["error"]
+    # A line that only exists with the other line_type is the first suggestion
+    assert index.check("src/app.py", 12, "old")["suggestions"][0] == {"line_number": 12, "line_type": "new"}
+
+
+def test_inline_comment_is_rejected_before_posting(monkeypatch):
+    details = {"diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h2"}}
+    monkeypatch.setattr(mcp_server, "fetch_mr_details", lambda mr_iid, project_path=None: details)
+    monkeypatch.setattr(mcp_server, "post_mr_discussion", lambda *args: pytest.fail("posted"))
+    patch_changes(monkeypatch)
+    with pytest.raises(ValueError, match="nearest commentable positions: new line 12, new line 11"):
+        mcp_server.add_mr_inline_comment(5, "src/app.py", 14, "x")
+
+
+def test_position_index_is_kept_for_merge_requests_too_large_to_cache(monkeypatch):
+    details = {"diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h3"}}
+    reads = []
+
+    def fake_iter_mr_changes(mr_iid, project_path=None, head_sha=None):
+        reads.append(head_sha)
+        mcp_server.mr_changes_cache.put((project_path, str(mr_iid), head_sha), SAMPLE_CHANGES)
+        return iter(SAMPLE_CHANGES)
+
+    # The changes alone exceed the whole cache
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", mcp_server.MRChangesCache(4, 60, 60))
+    monkeypatch.setattr(mcp_server, "fetch_mr_details", lambda mr_iid, project_path=None: details)
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", fake_iter_mr_changes)
+    monkeypatch.setattr(mcp_server, "post_mr_discussion", lambda *args: {"id": "d"})
+    for _ in range(3):
+        mcp_server.add_mr_inline_comment(5, "src/app.py", 11, "x")
+    assert reads == ["h3"]
+    assert mcp_server.mr_changes_cache.get((mcp_server.GITLAB_PROJECT_PATH, "5", "h3")) is None
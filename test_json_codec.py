@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the pluggable JSON codec of the JSON-RPC transport
+"""
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import JsonCodec  # noqa: E402
+
+MESSAGE = {"jsonrpc": "2.0", "id": 3, "result": {"content": [{"type": "text", "text": "café \"q\"\n\t☃"}]}}
+
+
+def test_every_codec_round_trips():
+    for name in ("auto", "orjson", "msgspec", "json"):
+        codec = JsonCodec(name)
+        encoded = codec.encode(MESSAGE)
+        assert isinstance(encoded, bytes)
+        assert b"\n" not in encoded and b": " not in encoded
+        assert codec.decode(encoded.decode("utf-8")) == MESSAGE
+        assert json.loads(encoded) == MESSAGE
+
+
+def test_unknown_or_missing_codec_falls_back_to_stdlib():
+    assert JsonCodec("json").name == "json"
+    assert JsonCodec("no-such-codec").name == "json"
+
+
+def test_values_rejected_by_fast_codecs_still_encode():
+    codec = JsonCodec("auto")
+    assert json.loads(codec.encode({"n": 2 ** 70})) == {"n": 2 ** 70}
+    assert json.loads(codec.encode({"s": "bad \ud800 surrogate"})) == {"s": "bad \ud800 surrogate"}
+
+
+def test_malformed_input_raises_value_error():
+    for name in ("auto", "json"):
+        try:
+            JsonCodec(name).decode("{not json")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("decode accepted malformed JSON")
+
+
+def test_respond_writes_utf8_bytes_when_available(monkeypatch):
+    class BinaryStdout(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.buffer = io.BytesIO()
+
+    stdout = BinaryStdout()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    mcp_server.respond(MESSAGE)
+    assert stdout.getvalue() == ""
+    assert json.loads(stdout.buffer.getvalue().decode("utf-8")) == MESSAGE
+
+
+def test_compact_commentable_lines_match_dumps(monkeypatch):
+    changes = [
+        {"new_path": "a.py", "diff": "@@ -1,2 +1,2 @@\n-é\n+\"x\"\n"},
+        {"new_path": "b.py", "diff": "", "omitted_diff_bytes": 9},
+    ]
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", lambda mr_iid: iter(changes))
+    expected = json.dumps(mcp_server.get_mr_commentable_lines(1), separators=(",", ":"))
+    assert "".join(mcp_server.iter_mr_commentable_lines_json(1, pretty=False)) == expected
+    monkeypatch.setattr(mcp_server, "iter_mr_changes", lambda mr_iid: iter([]))
+    assert "".join(mcp_server.iter_mr_commentable_lines_json(1, pretty=False)) == "[]"
+
+
+if __name__ == '__main__':
+    test_every_codec_round_trips()
+    test_unknown_or_missing_codec_falls_back_to_stdlib()
+    test_values_rejected_by_fast_codecs_still_encode()
+    test_malformed_input_raises_value_error()
+    print("All JSON codec tests passed!")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Tests for the merge request changes cache, conditional GET revalidation
+and read coalescing
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import MRChangesCache  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body
+        self.headers = headers or {}
+        self.content = b"{}" if body is not None else b""
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def make_changes(diff_size):
+    return [{"new_path": "a.py", "old_path": "a.py", "diff": "x" * diff_size}]
+
+
+def test_hit_and_miss_counts():
+    cache = MRChangesCache(max_entries=4, max_bytes=10000, ttl=60)
+    changes = make_changes(10)
+    assert cache.get(("g/p", "1", "sha1")) is None
+    cache.put(("g/p", "1", "sha1"), changes)
+    assert cache.get(("g/p", "1", "sha1")) is changes
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_new_push_invalidates_previous_head():
+    cache = MRChangesCache(max_entries=4, max_bytes=10000, ttl=60)
+    cache.put(("g/p", "1", "sha1"), make_changes(10))
+    cache.put(("g/p", "2", "sha1"), make_changes(10))
+    cache.put(("g/p", "1", "sha2"), make_changes(10))
+    assert cache.get(("g/p", "1", "sha1")) is None
+    assert cache.get(("g/p", "1", "sha2")) is not None
+    assert cache.get(("g/p", "2", "sha1")) is not None
+
+
+def test_size_aware_lru_eviction():
+    cache = MRChangesCache(max_entries=10, max_bytes=250, ttl=60)
+    cache.put(("g/p", "1", "a"), make_changes(100))
+    cache.put(("g/p", "2", "a"), make_changes(100))
+    # Touch MR 1 so MR 2 is the least recently used entry
+    cache.get(("g/p", "1", "a"))
+    cache.put(("g/p", "3", "a"), make_changes(100))
+    assert cache.get(("g/p", "2", "a")) is None
+    assert cache.get(("g/p", "1", "a")) is not None
+    assert cache.stats()["evictions"] == 1
+    # An entry larger than the whole cache is never stored
+    cache.put(("g/p", "4", "a"), make_changes(1000))
+    assert cache.get(("g/p", "4", "a")) is None
+
+
+def test_entries_expire_after_ttl():
+    cache = MRChangesCache(max_entries=4, max_bytes=10000, ttl=0.01)
+    cache.put(("g/p", "1", "a"), make_changes(10))
+    time.sleep(0.02)
+    assert cache.get(("g/p", "1", "a")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_derived_artifacts_live_and_die_with_the_entry():
+    cache = MRChangesCache(max_entries=4, max_bytes=10000, ttl=60)
+    cache.put_derived(("g/p", "1", "a"), "positions", "ignored", 10)
+    assert cache.get_derived(("g/p", "1", "a"), "positions") is None
+    cache.put(("g/p", "1", "a"), make_changes(100))
+    cache.put_derived(("g/p", "1", "a"), "positions", "index", 50)
+    assert cache.get_derived(("g/p", "1", "a"), "positions") == "index"
+    assert cache.stats()["bytes"] == 108 + 50
+    cache.put(("g/p", "1", "b"), make_changes(100))
+    assert cache.get_derived(("g/p", "1", "a"), "positions") is None
+    assert cache.stats()["bytes"] == 108
+
+
+def test_conditional_get_reuses_body_on_304(monkeypatch):
+    sent_headers = []
+
+    def fake_request(method, url, headers=None, **kwargs):
+        sent_headers.append(dict(headers or {}))
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, {"iid": 1}, {"ETag": '"v1"'})
+
+    monkeypatch.setattr(mcp_server, "gitlab_request", fake_request)
+    monkeypatch.setattr(mcp_server, "revalidation_store", mcp_server.RevalidationStore(8, 1024))
+    first = mcp_server.gitlab_get_json("https://gitlab.test/api/v4/x")
+    second = mcp_server.gitlab_get_json("https://gitlab.test/api/v4/x")
+    assert second is first
+    assert sent_headers == [{}, {"If-None-Match": '"v1"'}]
+    assert mcp_server.revalidation_store.stats()["not_modified"] == 1
+
+
+def test_concurrent_reads_share_one_request(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def fake_request(method, url, headers=None, **kwargs):
+        calls.append(url)
+        release.wait(2)
+        return FakeResponse(200, {"iid": 1})
+
+    monkeypatch.setattr(mcp_server, "gitlab_request", fake_request)
+    monkeypatch.setattr(mcp_server, "read_flights", mcp_server.SingleFlight())
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(mcp_server.gitlab_get_json("https://gitlab.test/api/v4/mr")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while mcp_server.read_flights.stats()["shared"] < 3:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert calls == ["https://gitlab.test/api/v4/mr"]
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+
+
+def test_cursor_pages_are_served_from_cache(monkeypatch):
+    changes = [{"new_path": f"f{i}.py", "diff": "+x\n" * (i + 1)} for i in range(5)]
+    requested = []
+
+    def fake_request(method, url, headers=None, **kwargs):
+        requested.append(url)
+        if url.endswith("/changes"):
+            return FakeResponse(200, {"changes": changes, "diff_refs": {"head_sha": "h1"}})
+        return FakeResponse(200, {"diff_refs": {"head_sha": "h1"}})
+
+    monkeypatch.setattr(mcp_server, "gitlab_request", fake_request)
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10000, 60))
+    monkeypatch.setattr(mcp_server, "revalidation_store", mcp_server.RevalidationStore(8, 10000))
+
+    page = mcp_server.fetch_mr_diff_page(9, page_size=2)
+    files = [f["file"] for f in page["files"]]
+    fetched = len(requested)
+    while page["next_cursor"]:
+        page = mcp_server.fetch_mr_diff_page(9, cursor=page["next_cursor"], page_size=2)
+        files.extend(f["file"] for f in page["files"])
+    assert files == [c["new_path"] for c in changes]
+    assert page["total_files"] == 5
+    assert len(requested) == fetched
+
+
+
+def test_repeat_lookups_cost_no_request_while_head_is_fresh(monkeypatch):
+    requested = []
+
+    def fake_request(method, url, headers=None, **kwargs):
+        requested.append(url.rsplit("/", 1)[1])
+        if url.endswith("/changes"):
+            return FakeResponse(200, {"changes": make_changes(10), "diff_refs": {"head_sha": "h1"}})
+        return FakeResponse(200, {"diff_refs": {"head_sha": "h1"}})
+
+    monkeypatch.setattr(mcp_server, "gitlab_request", fake_request)
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10000, 60))
+    monkeypatch.setattr(mcp_server, "revalidation_store", mcp_server.RevalidationStore(8, 10000))
+
+    # A cold miss reads /changes directly and keys it by the head in the payload
+    mcp_server.fetch_mr_changes(5)
+    assert requested == ["changes"]
+    mcp_server.fetch_mr_changes(5)
+    mcp_server.fetch_mr_diff_stats(5)
+    assert requested == ["changes"]
+
+    # Once the head is older than MR_CACHE_HEAD_TTL, it is checked again with the MR details
+    monkeypatch.setattr(mcp_server, "MR_CACHE_HEAD_TTL", 0)
+    mcp_server.fetch_mr_changes(5)
+    assert requested == ["changes", "5"]
+
+    test_hit_and_miss_counts()
+    test_new_push_invalidates_previous_head()
+    test_size_aware_lru_eviction()
+    test_entries_expire_after_ttl()
+    print("All cache tests passed!")
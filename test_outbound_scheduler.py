@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the rate-limit-aware outbound request scheduler
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import PRIORITY_READ, PRIORITY_WRITE, OutboundScheduler  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_writes_are_scheduled_before_waiting_reads():
+    scheduler = OutboundScheduler(rate=20, burst=1)
+    key = ("gitlab.test", "token")
+    scheduler.acquire(key)
+    order = []
+
+    def run(name, priority):
+        scheduler.acquire(key, priority)
+        order.append(name)
+
+    read = threading.Thread(target=run, args=("read", PRIORITY_READ))
+    read.start()
+    time.sleep(0.01)
+    write = threading.Thread(target=run, args=("write", PRIORITY_WRITE))
+    write.start()
+    read.join(2)
+    write.join(2)
+    assert order == ["write", "read"]
+
+
+def test_retry_after_pauses_the_bucket():
+    scheduler = OutboundScheduler(rate=100, burst=5)
+    key = ("gitlab.test", "token")
+    scheduler.update(key, FakeResponse(429, {"Retry-After": "0.2"}))
+    started = time.monotonic()
+    scheduler.acquire(key)
+    assert time.monotonic() - started >= 0.15
+    assert scheduler.stats()["rate_limited"] == 1
+
+
+def test_low_remaining_quota_slows_the_rate():
+    scheduler = OutboundScheduler(rate=100, burst=5)
+    key = ("gitlab.test", "token")
+    scheduler.update(key, FakeResponse(200, {
+        "RateLimit-Remaining": "2",
+        "RateLimit-Reset": str(int(time.time()) + 20)
+    }))
+    assert scheduler._buckets[key].rate <= 0.15
+    assert scheduler._buckets[key].tokens <= 2
+
+
+def test_gitlab_request_retries_after_429(monkeypatch):
+    responses = [FakeResponse(429, {"Retry-After": "0"}), FakeResponse(200)]
+
+    class FakeSession:
+        def request(self, method, url, **kwargs):
+            return responses.pop(0)
+
+    monkeypatch.setattr(mcp_server, "get_gitlab_session", lambda: FakeSession())
+    monkeypatch.setattr(mcp_server, "outbound_scheduler", OutboundScheduler(rate=100, burst=5))
+    resp = mcp_server.gitlab_request("POST", "https://gitlab.test/api/v4/x", json={})
+    assert resp.status_code == 200
+    assert responses == []
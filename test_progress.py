@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tests for progress notifications of long-running tool calls
+"""
+import http.client
+import json
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import CallContext, MRChangesCache  # noqa: E402
+
+CHANGE = {"new_path": "a.py", "old_path": "a.py", "diff": "@@ -1,1 +1,2 @@\n ctx\n+added\n"}
+
+
+class SlowGitLab(BaseHTTPRequestHandler):
+    """Serves a /changes body of 200 files in small pieces over about half a second"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.endswith("/changes"):
+            body = json.dumps({"diff_refs": {"head_sha": "h1"}, "changes": [CHANGE] * 200}).encode()
+            pieces = [body[i:i + 1024] for i in range(0, len(body), 1024)]
+        else:
+            pieces = [json.dumps({"iid": 1, "diff_refs": {"head_sha": "h1"}}).encode()]
+        self.send_response(200)
+        self.send_header("Content-Length", str(sum(len(p) for p in pieces)))
+        self.end_headers()
+        for piece in pieces:
+            self.wfile.write(piece)
+            self.wfile.flush()
+            time.sleep(0.5 / len(pieces))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gitlab(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowGitLab)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(mcp_server, "GITLAB_URL", "http://127.0.0.1:%d" % server.server_address[1])
+    monkeypatch.setattr(mcp_server, "GITLAB_STREAM_CHUNK_SIZE", 1024)
+    monkeypatch.setattr(mcp_server, "MCP_PROGRESS_INTERVAL", 0.05)
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", MRChangesCache(4, 10 ** 9, 60))
+    monkeypatch.setattr(mcp_server, "revalidation_store", mcp_server.RevalidationStore(16, 10 ** 9))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def commentable_lines_call(meta=None):
+    params = {"name": "get_merge_request_commentable_lines", "arguments": {"mr_iid": 1}}
+    if meta is not None:
+        params["_meta"] = meta
+    return json.dumps({"jsonrpc": "2.0", "id": 9, "method": "tools/call", "params": params})
+
+
+def serve(line):
+    sent = []
+    executor = ThreadPoolExecutor(max_workers=1)
+    lines = iter([line, ""])
+    wait(mcp_server.serve_lines(lambda: next(lines), sent.append, executor), timeout=10)
+    executor.shutdown(wait=True)
+    return sent
+
+
+def test_progress_precedes_response_and_increases(gitlab):
+    sent = serve(commentable_lines_call({"progressToken": "tok"}))
+    *progress, response = sent
+    assert response["id"] == 9 and len(json.loads(response["result"]["content"][0]["text"])) == 200
+    assert len(progress) >= 3
+    assert all(n["method"] == "notifications/progress" and "id" not in n for n in progress)
+    assert {n["params"]["progressToken"] for n in progress} == {"tok"}
+    values = [n["params"]["progress"] for n in progress]
+    assert values == sorted(set(values))
+    # The value counts bytes only, the sum of the per-stage byte counts in the message
+    for n in progress:
+        stage_bytes = re.findall(r"(\d+) bytes", n["params"]["message"])
+        assert n["params"]["progress"] == sum(int(b) for b in stage_bytes)
+    assert progress[0]["params"]["message"].startswith("fetch: ")
+    assert "parse: " in progress[-1]["params"]["message"] or "serialize: " in progress[-1]["params"]["message"]
+
+
+def test_no_progress_without_token(gitlab):
+    sent = serve(commentable_lines_call())
+    assert [m["id"] for m in sent] == [9]
+
+
+def test_progress_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(mcp_server, "MCP_PROGRESS_INTERVAL", 10)
+    sent = []
+    context = CallContext(1, 7, sent.append)
+    for _ in range(1000):
+        context.add_progress("parse", files=1, nbytes=100)
+    assert len(sent) == 1
+    context.end_progress()
+    monkeypatch.setattr(mcp_server, "MCP_PROGRESS_INTERVAL", 0)
+    context.add_progress("parse", files=1)
+    assert len(sent) == 1
+
+
+def test_progress_events_on_http_stream(gitlab):
+    server = mcp_server.create_http_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+        connection.request("POST", "/mcp", body=commentable_lines_call({"progressToken": 3}),
+                           headers={"Content-Type": "application/json", "Accept": "text/event-stream"})
+        events = [e for e in connection.getresponse().read().decode().split("\n\n") if e]
+        messages = [json.loads(e.split("data: ", 1)[1]) for e in events]
+        assert messages[-1]["id"] == 9
+        assert messages[0]["method"] == "notifications/progress"
+        assert messages[0]["params"]["progressToken"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown(wait=True)
+
+
+
+class TricklingWriter:
+    """Writes in small pieces with pauses between them, as a socket does when the client reads slowly"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        for start in range(0, len(data), 256):
+            self.wfile.write(data[start:start + 256])
+            time.sleep(0.0005)
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def test_batch_progress_events_on_http_stream(monkeypatch):
+    def busy(params):
+        for i in range(20):
+            mcp_server.report_progress("%s-%d" % (params["name"], i), files=1, nbytes=1)
+        return params["name"]
+
+    def setup(handler):
+        socketserver.StreamRequestHandler.setup(handler)
+        handler.wfile = TricklingWriter(handler.wfile)
+
+    monkeypatch.setitem(mcp_server.TOOL_HANDLERS, "busy", busy)
+    # Slow writes give the two calls of the batch every chance to interleave their events
+    monkeypatch.setattr(mcp_server.MCPHTTPRequestHandler, "setup", setup)
+    batch = [{"jsonrpc": "2.0", "id": n, "method": "tools/call",
+              "params": {"name": "busy", "arguments": {"name": name}, "_meta": {"progressToken": name}}}
+             for n, name in ((1, "a"), (2, "b"))]
+    server = mcp_server.create_http_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+        connection.request("POST", "/mcp", body=json.dumps(batch),
+                           headers={"Content-Type": "application/json", "Accept": "text/event-stream"})
+        events = [e for e in connection.getresponse().read().decode().split("\n\n") if e]
+        assert all(e.startswith("event: message\ndata: ") for e in events)
+        messages = [json.loads(e.split("data: ", 1)[1]) for e in events]
+        responses = messages.pop()
+        assert sorted(r["result"]["content"][0]["text"] for r in responses) == ["a", "b"]
+        for token in ("a", "b"):
+            progress = [m["params"]["progress"] for m in messages if m["params"]["progressToken"] == token]
+            assert progress == list(range(1, 21))
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown(wait=True)
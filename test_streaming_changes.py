@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental decoding of /changes responses and the paginated /diffs backend
+"""
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gitlab_mcp_server import mcp_server  # noqa: E402
+from gitlab_mcp_server.mcp_server import iter_json_array_items  # noqa: E402
+
+SAMPLE_RESPONSE = {
+    "title": "changes",
+    "description": 'Mentions "changes": [1] in a string',
+    "diff_refs": {"changes": [9]},
+    "changes": [
+        {"new_path": "a.py", "diff": "@@ -1 +1 @@\n-a = \"]}\"\n+a = '\\\\'\n"},
+        {"new_path": "b.py", "diff": "+é ∑ \\u00e9"},
+        [1, 2],
+        "text",
+        -12.5e3,
+        None,
+        True
+    ],
+    "overflow": False
+}
+
+
+def random_chunks(text, max_size):
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = random.randint(1, max_size)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def test_items_match_full_decode_for_any_chunking():
+    random.seed(42)
+    expected = SAMPLE_RESPONSE["changes"]
+    for text in (json.dumps(SAMPLE_RESPONSE), json.dumps(SAMPLE_RESPONSE, indent=2, ensure_ascii=False)):
+        assert list(iter_json_array_items([text], "changes")) == expected
+        assert list(iter_json_array_items(list(text), "changes")) == expected
+        for _ in range(200):
+            assert list(iter_json_array_items(random_chunks(text, 9), "changes")) == expected
+
+
+def test_missing_or_non_array_key_yields_nothing():
+    assert list(iter_json_array_items(['{"id": 1, "other": [1]}'], "changes")) == []
+    assert list(iter_json_array_items(['{"changes": null, "x": []}'], "changes")) == []
+    assert list(iter_json_array_items(['{"changes": []}'], "changes")) == []
+
+
+def test_truncated_array_raises():
+    try:
+        list(iter_json_array_items(['{"changes": [{"a": 1}, {"b"'], "changes"))
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError for a truncated array")
+
+
+class FakePageResponse:
+    def __init__(self, body, headers):
+        self._body = body
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._body
+
+
+def fake_diffs_endpoint(total, with_headers):
+    requested = []
+
+    def fake_request(method, url, params=None, **kwargs):
+        page, per_page = params["page"], params["per_page"]
+        requested.append(page)
+        start = (page - 1) * per_page
+        body = [{"new_path": f"f{i}.py", "diff": f"+{i}"} for i in range(start, min(start + per_page, total))]
+        headers = {}
+        if with_headers:
+            headers["X-Next-Page"] = str(page + 1) if start + per_page < total else ""
+        return FakePageResponse(body, headers)
+
+    return fake_request, requested
+
+
+def test_diffs_pages_are_read_to_completion(monkeypatch):
+    for with_headers in (True, False):
+        for prefetch in (True, False):
+            fake_request, requested = fake_diffs_endpoint(7, with_headers)
+            monkeypatch.setattr(mcp_server, "gitlab_request", fake_request)
+            diffs = list(mcp_server.iter_mr_diffs_pages("https://gitlab.test/diffs", per_page=3, prefetch=prefetch))
+            assert [d["new_path"] for d in diffs] == [f"f{i}.py" for i in range(7)]
+            assert sorted(requested) == [1, 2, 3]
+
+
+
+def test_only_small_incremental_reads_are_collected_for_the_cache(monkeypatch):
+    monkeypatch.setattr(mcp_server, "mr_changes_cache", mcp_server.MRChangesCache(4, 10 ** 6, 60))
+    monkeypatch.setattr(mcp_server, "GITLAB_STREAM_CACHE_MAX_BYTES", 100)
+    small = [{"new_path": "a.py", "diff": "+x" * 10}]
+    large = [{"new_path": f"f{i}.py", "diff": "+x" * 10} for i in range(10)]
+    assert list(mcp_server.cache_changes_as_read(iter(small), ("g/p", "1", "h"))) == small
+    assert list(mcp_server.cache_changes_as_read(iter(large), ("g/p", "2", "h"))) == large
+    assert mcp_server.mr_changes_cache.get(("g/p", "1", "h")) == small
+    # Far below MR_CACHE_MAX_BYTES, but over the incremental cap
+    assert mcp_server.mr_changes_cache.get(("g/p", "2", "h")) is None
+
+    test_items_match_full_decode_for_any_chunking()
+    test_missing_or_non_array_key_yields_nothing()
+    test_truncated_array_raises()
+    print("All streaming decode tests passed!")